@@ -46,6 +46,7 @@ async function processFrameAsync(buffer: Buffer) {
       console.log(`Detected ${result.faces.length} face(s)`)
       
       // For each recognized face, call the verify endpoint
+      // (unknown and low-quality faces come back with faceId null)
       for (const face of result.faces) {
         if (face.faceId) {
           console.log(`Recognized face: ${face.faceId}`)
@@ -4,14 +4,20 @@ Shows window with detection boxes
 
 Run from project root:
     python detect_face.py
+
+For many images (directory or glob, headless, parallel) use hardware/detect_batch.py
 """
 
 import cv2
 import numpy as np
-import insightface
 import os
+import sys
 from pathlib import Path
 
+# Shared model setup lives next to the service
+sys.path.insert(0, str(Path(__file__).parent / "hardware"))
+from face_models import ServiceFaceAnalyzer, get_face_analyzer
+
 # Get project root directory
 project_root = Path(__file__).parent
 image_path = project_root / "image.jpg"
@@ -38,12 +44,12 @@ def detect_face():
     # Initialize InsightFace (same as service)
     print("\n🔧 Initializing InsightFace...")
     try:
-        face_analyzer = insightface.app.FaceAnalysis(
-            name='buffalo_l',
-            providers=['CPUExecutionProvider']
-        )
-        face_analyzer.prepare(ctx_id=0, det_size=(640, 640))
-        print("✅ InsightFace initialized!")
+        # Reuses the running service's model when it is up (USE_FACE_SERVICE=false to skip)
+        face_analyzer = get_face_analyzer()
+        if isinstance(face_analyzer, ServiceFaceAnalyzer):
+            print(f"✅ Using the running face recognition service at {face_analyzer.url}")
+        else:
+            print("✅ InsightFace initialized!")
     except Exception as e:
         print(f"❌ Error initializing InsightFace: {e}")
         import traceback
@@ -0,0 +1,305 @@
+"""
+Benchmark suite for the face recognition pipeline
+
+Times each stage of the service in-process with the real models:
+    startup      model load with/without the optimized graph cache, service model load
+                 + warm-up, gallery load of N enrolled photos (via nextjs_emulator)
+    decode       JPEG decode
+    detection    SCRFD detection at each det_size
+    recognition  ArcFace embedding, per face
+    gallery      best-match search at 1k / 10k / 100k identities
+    request      full POST /api/hardware/video-stream (Flask test client)
+
+Results are written as JSON. Pass --compare with a saved run to flag stages
+whose median got slower than --threshold; the exit code is 1 on regression,
+so it can gate a deployment.
+
+Run:
+    python benchmark.py --output baseline.json
+    python benchmark.py --compare baseline.json
+    python benchmark.py --only decode,gallery --gallery-sizes 1000,100000
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+import face_recognition_insightface as service
+
+BENCHMARKS = ('startup', 'decode', 'detection', 'recognition', 'gallery', 'request')
+
+def measure(fn, iterations, warmup=3):
+    """
+    Call fn repeatedly and summarize its duration
+
+    Returns:
+        {'iterations', 'mean_ms', 'median_ms', 'p95_ms', 'min_ms', 'stdev_ms'}
+    """
+    for _ in range(warmup):
+        fn()
+
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+
+    times.sort()
+    return {
+        'iterations': iterations,
+        'mean_ms': round(statistics.fmean(times), 3),
+        'median_ms': round(statistics.median(times), 3),
+        'p95_ms': round(times[min(len(times) - 1, int(0.95 * len(times)))], 3),
+        'min_ms': round(times[0], 3),
+        'stdev_ms': round(statistics.stdev(times), 3) if len(times) > 1 else 0.0
+    }
+
+def synthetic_gallery(size, seed=0):
+    """GallerySnapshot of size random identities (same seed, same gallery)"""
+    rng = np.random.default_rng(seed)
+    embeddings = rng.standard_normal((size, service.EMBEDDING_DIM), dtype=np.float32)
+    return service.GallerySnapshot(0, {f"face-{i:06d}": embeddings[i] for i in range(size)})
+
+def bench_startup(args, jpeg_bytes):
+    """Cold start: model load, then loading N enrolled photos from the emulated Next.js API"""
+    from werkzeug.serving import make_server
+    import nextjs_emulator
+
+    import face_models
+
+    # Model load (cache lookup + session creation) with and without the optimized
+    # graph cache. The cached loads use an empty scratch cache, so the first one
+    # is always a miss (optimize_ms) and the second a hit
+    results = {}
+    cache_dir = face_models.MODEL_CACHE_DIR
+    face_models.MODEL_CACHE_DIR = tempfile.mkdtemp(prefix='face-benchmark-cache-')
+    try:
+        for label, cache in (('no_cache', False), ('cache_first', True), ('cache', True)):
+            face_models.create_face_analyzer(cache=cache)
+            results[f'startup.sessions.{label}'] = {
+                'iterations': 1,
+                'median_ms': round(face_models.load_stats['lookup_ms'] + face_models.load_stats['sessions_ms'], 1),
+                'cache': face_models.load_stats['cache'],
+                'lookup_ms': face_models.load_stats['lookup_ms'],
+                'optimize_ms': face_models.load_stats['optimize_ms']
+            }
+    finally:
+        shutil.rmtree(face_models.MODEL_CACHE_DIR, ignore_errors=True)
+        face_models.MODEL_CACHE_DIR = cache_dir
+
+    start = time.perf_counter()
+    if not service.initialize_insightface():
+        raise RuntimeError('InsightFace failed to initialize')
+    results['startup.model_load'] = {'iterations': 1, 'median_ms': round((time.perf_counter() - start) * 1000, 3)}
+
+    photo_dir = tempfile.mkdtemp(prefix='face-benchmark-')
+    photo_path = os.path.join(photo_dir, 'photo.jpg')
+    with open(photo_path, 'wb') as f:
+        f.write(jpeg_bytes)
+
+    server = make_server('127.0.0.1', 0, nextjs_emulator.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    nextjs_url, use_nextjs = service.NEXTJS_API_URL, service.USE_NEXTJS_VERIFICATION
+    service.NEXTJS_API_URL = f"http://127.0.0.1:{server.server_port}"
+    service.USE_NEXTJS_VERIFICATION = True
+    try:
+        for count in args.startup_photos:
+            nextjs_emulator.set_roster(nextjs_emulator.synthetic_roster(count, [photo_path], 1.0, True))
+            service.publish_gallery({}, replace=True)
+            start = time.perf_counter()
+            service.load_enrolled_faces_from_database()
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            results[f'startup.gallery_load.{count}'] = {
+                'iterations': 1,
+                'median_ms': round(elapsed_ms, 3),
+                'per_photo_ms': round(elapsed_ms / count, 3),
+                'loaded': len(service.gallery)
+            }
+    finally:
+        server.shutdown()
+        os.remove(photo_path)
+        os.rmdir(photo_dir)
+        service.NEXTJS_API_URL, service.USE_NEXTJS_VERIFICATION = nextjs_url, use_nextjs
+        service.publish_gallery({}, replace=True)
+    return results
+
+def bench_decode(args, jpeg_bytes):
+    image = service.decode_frame(jpeg_bytes)
+    return {'decode': dict(measure(lambda: service.decode_frame(jpeg_bytes), args.iterations),
+                           width=image.shape[1], height=image.shape[0], jpeg_bytes=len(jpeg_bytes))}
+
+def bench_detection(args, jpeg_bytes):
+    rgb_image, _ = service.prepare_detection_input(service.decode_frame(jpeg_bytes))
+    det_model = service.face_analyzer.det_model
+    default_size = det_model.input_size
+
+    results = {}
+    try:
+        for size in args.det_sizes:
+            det_model.prepare(0, input_size=(size, size))
+            bboxes, _ = det_model.detect(rgb_image, max_num=0, metric='default')
+            results[f'detection.{size}'] = dict(
+                measure(lambda: det_model.detect(rgb_image, max_num=0, metric='default'), args.iterations),
+                faces=int(bboxes.shape[0])
+            )
+    finally:
+        det_model.prepare(0, input_size=default_size)
+    return results
+
+def bench_recognition(args, jpeg_bytes):
+    rgb_image, _ = service.prepare_detection_input(service.decode_frame(jpeg_bytes))
+    bboxes, kpss = service.face_analyzer.det_model.detect(rgb_image, max_num=0, metric='default')
+    if bboxes.shape[0] == 0:
+        print("  (no face in the benchmark image - skipping recognition)")
+        return {}
+
+    recognition_model = service.face_analyzer.models['recognition']
+    face = service.Face(bbox=bboxes[0, 0:4], kps=kpss[0] if kpss is not None else None, det_score=bboxes[0, 4])
+    return {'recognition.per_face': measure(lambda: recognition_model.get(rgb_image, face), args.iterations)}
+
+def bench_gallery(args, jpeg_bytes):
+    query = np.random.default_rng(1).standard_normal(service.EMBEDDING_DIM, dtype=np.float32)
+    results = {}
+    for size in args.gallery_sizes:
+        snapshot = synthetic_gallery(size)
+        results[f'gallery.search.{size}'] = measure(lambda: snapshot.best_match(query), args.iterations)
+    return results
+
+def bench_request(args, jpeg_bytes):
+    """Full /api/hardware/video-stream request through Flask, Next.js verification off"""
+    client = service.app.test_client()
+    use_nextjs = service.USE_NEXTJS_VERIFICATION
+    service.USE_NEXTJS_VERIFICATION = False
+    service.publish_gallery(dict(synthetic_gallery(args.request_gallery_size).embeddings), replace=True)
+
+    def post_frame():
+        response = client.post(
+            '/api/hardware/video-stream',
+            data=jpeg_bytes,
+            headers={'Content-Type': 'image/jpeg', 'X-Camera-Id': 'benchmark'}
+        )
+        if response.status_code != 200:
+            raise RuntimeError(f'video-stream returned {response.status_code}')
+
+    try:
+        return {'request.video_stream': dict(measure(post_frame, args.iterations),
+                                             gallery_size=args.request_gallery_size)}
+    finally:
+        service.USE_NEXTJS_VERIFICATION = use_nextjs
+        service.publish_gallery({}, replace=True)
+
+def environment_info():
+    """Everything a run depends on, to tell whether two runs are comparable"""
+    import insightface
+    import onnxruntime
+
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'onnxruntime': onnxruntime.__version__,
+        'insightface': insightface.__version__
+    }
+
+def compare(results, baseline, threshold):
+    """
+    Print median changes against a baseline run
+
+    Returns:
+        Names of benchmarks whose median grew by more than threshold
+    """
+    regressions = []
+    print(f"\n{'benchmark':<32} {'baseline ms':>12} {'current ms':>12} {'change':>8}")
+    for name, current in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous or not previous.get('median_ms'):
+            print(f"{name:<32} {'-':>12} {current['median_ms']:>12.3f} {'new':>8}")
+            continue
+        change = current['median_ms'] / previous['median_ms'] - 1
+        flag = '  REGRESSION' if change > threshold else ''
+        print(f"{name:<32} {previous['median_ms']:>12.3f} {current['median_ms']:>12.3f} {change:>+8.1%}{flag}")
+        if change > threshold:
+            regressions.append(name)
+
+    baseline_env = baseline.get('environment', {})
+    current_env = environment_info()
+    for key in ('onnxruntime', 'insightface', 'cpu_count', 'processor'):
+        if baseline_env.get(key) != current_env.get(key):
+            print(f"Note: {key} differs from the baseline ({baseline_env.get(key)})")
+    return regressions
+
+def int_list(value):
+    return [int(item) for item in value.split(',') if item]
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the face recognition pipeline')
+    parser.add_argument('--image', default=os.path.join(os.path.dirname(__file__), 'image1.jpg'),
+                        help='JPEG frame to benchmark with (default: hardware/image1.jpg)')
+    parser.add_argument('--only', help=f"Comma-separated subset of: {', '.join(BENCHMARKS)}")
+    parser.add_argument('--iterations', type=int, default=30, help='Timed runs per benchmark (default: %(default)s)')
+    parser.add_argument('--det-sizes', type=int_list, default=[320, 480, 640], help='Detection input sizes')
+    parser.add_argument('--gallery-sizes', type=int_list, default=[1000, 10000, 100000], help='Gallery sizes to search')
+    parser.add_argument('--startup-photos', type=int_list, default=[10, 100], help='Enrolled photos for cold start')
+    parser.add_argument('--request-gallery-size', type=int, default=1000, help='Gallery size for the full request')
+    parser.add_argument('--output', default='benchmark_results.json', help='Results file (default: %(default)s)')
+    parser.add_argument('--compare', metavar='BASELINE', help='Saved results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Median slowdown that counts as a regression (default: %(default)s)')
+    args = parser.parse_args()
+
+    selected = args.only.split(',') if args.only else list(BENCHMARKS)
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(sorted(unknown))}")
+
+    with open(args.image, 'rb') as f:
+        jpeg_bytes = f.read()
+
+    # Benchmark numbers, not log output
+    service.logger.setLevel('WARNING')
+    service.SHOW_WINDOW = False
+
+    if 'startup' not in selected and not service.initialize_insightface():
+        print("InsightFace failed to initialize")
+        sys.exit(1)
+
+    results = {}
+    for name in BENCHMARKS:
+        if name not in selected:
+            continue
+        print(f"Running {name}...")
+        results.update(globals()[f'bench_{name}'](args, jpeg_bytes))
+
+    for name, stats in results.items():
+        print(f"  {name:<32} median {stats['median_ms']:>10.3f} ms")
+
+    with open(args.output, 'w') as f:
+        json.dump({'environment': environment_info(), 'image': args.image, 'results': results}, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        print("\nNo regressions")
+
+if __name__ == "__main__":
+    main()
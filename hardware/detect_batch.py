@@ -0,0 +1,147 @@
+"""
+Batch face detection for directories of images (headless)
+
+Distributes images over a process pool - each worker loads InsightFace
+once and reuses it for every image it gets - and streams one JSON line per
+image to the output as soon as it is done. Embeddings go to a separate
+.npy matrix; each face in the JSONL refers to its row.
+
+Output (JSONL, one line per image, in completion order):
+    {"path": "...", "width": 640, "height": 480,
+     "faces": [{"bbox": [x1, y1, x2, y2], "score": 0.91, "embedding_row": 0}],
+     "error": null}
+
+Run:
+    python detect_batch.py photos/ --output faces.jsonl
+    python detect_batch.py "captures/**/*.jpg" --workers 4 --embeddings faces.npy
+"""
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+# Per-worker model (set by init_worker in each pool process)
+worker_analyzer = None
+
+def collect_images(inputs):
+    """Expand directories (recursively) and glob patterns into a sorted list of image paths"""
+    paths = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                paths.update(os.path.join(root, name) for name in files
+                             if name.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            paths.update(path for path in glob.glob(item, recursive=True)
+                         if path.lower().endswith(IMAGE_EXTENSIONS))
+    return sorted(paths)
+
+def init_worker(det_size):
+    """Pool initializer: load InsightFace once per worker process"""
+    global worker_analyzer
+    from face_models import create_face_analyzer
+
+    worker_analyzer = create_face_analyzer(det_size=(det_size, det_size))
+
+def detect_image(path):
+    """
+    Detect faces in one image (runs in a worker)
+
+    Returns:
+        (record dict without embedding rows, (N, 512) float32 embeddings)
+    """
+    import cv2
+
+    record = {'path': path, 'width': None, 'height': None, 'faces': [], 'error': None}
+    image = cv2.imread(path)
+    if image is None:
+        record['error'] = 'Could not read image'
+        return record, None
+
+    record['height'], record['width'] = image.shape[:2]
+    faces = worker_analyzer.get(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+
+    record['faces'] = [
+        {
+            'bbox': [round(float(v), 1) for v in face.bbox],
+            'score': round(float(face.det_score), 4)
+        }
+        for face in faces
+    ]
+    embeddings = np.stack([face.embedding for face in faces]).astype(np.float32) if faces else None
+    return record, embeddings
+
+def write_npy(path, raw_path, rows, dim):
+    """Turn a raw float32 row file into a .npy file without loading it into memory"""
+    with open(path, 'wb') as out:
+        np.lib.format.write_array_header_1_0(out, {
+            'descr': '<f4', 'fortran_order': False, 'shape': (rows, dim)
+        })
+        with open(raw_path, 'rb') as raw:
+            shutil.copyfileobj(raw, out)
+
+def main():
+    parser = argparse.ArgumentParser(description='Detect faces in many images with a process pool')
+    parser.add_argument('inputs', nargs='+', help='Image directories and/or glob patterns')
+    parser.add_argument('--output', default='faces.jsonl', help='JSONL results (default: %(default)s)')
+    parser.add_argument('--embeddings', help='Embedding matrix .npy (default: output name with .npy)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='Worker processes, one model each (default: CPU count)')
+    parser.add_argument('--det-size', type=int, default=640, help='Detector input size (default: %(default)s)')
+    args = parser.parse_args()
+
+    paths = collect_images(args.inputs)
+    if not paths:
+        print("No images found")
+        sys.exit(1)
+
+    embeddings_path = args.embeddings or os.path.splitext(args.output)[0] + '.npy'
+    raw_path = embeddings_path + '.part'
+    workers = max(1, min(args.workers, len(paths)))
+    print(f"{len(paths)} image(s), {workers} worker(s) -> {args.output}, {embeddings_path}", file=sys.stderr)
+
+    start = time.perf_counter()
+    rows = 0
+    dim = 512
+    failed = 0
+    with open(args.output, 'w') as out, open(raw_path, 'wb') as raw, \
+            ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(args.det_size,)) as pool:
+        futures = {pool.submit(detect_image, path): path for path in paths}
+        for done, future in enumerate(as_completed(futures), start=1):
+            try:
+                record, embeddings = future.result()
+            except Exception as e:
+                record, embeddings = {'path': futures[future], 'faces': [], 'error': str(e)}, None
+
+            if embeddings is not None:
+                dim = embeddings.shape[1]
+                for face, row in zip(record['faces'], range(rows, rows + len(embeddings))):
+                    face['embedding_row'] = row
+                raw.write(embeddings.tobytes())
+                rows += len(embeddings)
+            if record['error']:
+                failed += 1
+
+            out.write(json.dumps(record) + '\n')
+            out.flush()
+            print(f"[{done}/{len(paths)}] {record['path']}: "
+                  f"{record['error'] or str(len(record['faces'])) + ' face(s)'}", file=sys.stderr)
+
+    write_npy(embeddings_path, raw_path, rows, dim)
+    os.remove(raw_path)
+
+    elapsed = time.perf_counter() - start
+    print(f"Done: {len(paths)} image(s), {rows} face(s), {failed} error(s) in {elapsed:.1f}s "
+          f"({len(paths) / elapsed:.1f} images/s)", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -4,15 +4,18 @@ Uses the InsightFace face recognition service
 
 Run:
     python detect_from_image.py
+
+For many images (directory or glob, headless, parallel) use detect_batch.py
 """
 
 import cv2
 import numpy as np
-import insightface
 import os
 import sys
 from pathlib import Path
 
+from face_models import ServiceFaceAnalyzer, get_face_analyzer
+
 # Get project root directory (parent of hardware folder)
 project_root = Path(__file__).parent.parent
 image_path = project_root / "image.jpg"
@@ -39,12 +42,12 @@ def detect_faces_in_image(image_path):
     # Initialize InsightFace
     print("\n🔧 Initializing InsightFace...")
     try:
-        face_analyzer = insightface.app.FaceAnalysis(
-            name='buffalo_l',
-            providers=['CPUExecutionProvider']
-        )
-        face_analyzer.prepare(ctx_id=0, det_size=(640, 640))
-        print("✅ InsightFace initialized successfully!")
+        # Reuses the running service's model when it is up (USE_FACE_SERVICE=false to skip)
+        face_analyzer = get_face_analyzer()
+        if isinstance(face_analyzer, ServiceFaceAnalyzer):
+            print(f"✅ Using the running face recognition service at {face_analyzer.url}")
+        else:
+            print("✅ InsightFace initialized successfully!")
     except Exception as e:
         print(f"❌ Error initializing InsightFace: {e}")
         return None
@@ -5,7 +5,7 @@
  * 1. Infrared sensor (IR) detection for person presence
  * 2. Conditional ESP32-CAM activation based on detection
  * 3. Video streaming only when person is detected
- * 4. HTTP streaming to server endpoint
+ * 4. Persistent TCP frame stream to the server (HTTP POST per frame as fallback)
  * 
  * Hardware Connections:
  * - IR Sensor: GPIO 13 (you can change this)
@@ -26,6 +26,17 @@
 const char* ssid = "BDSET";
 const char* password = "Bdset@1234";
 const char* serverURL = "http://192.168.1.110:5000";  // Python face recognition service
+const char* cameraId = "default";  // Selects per-camera settings in the Python service (cameras.json)
+
+// Persistent frame stream (one open connection instead of an HTTP POST per frame)
+const char* streamHost = "192.168.1.110";  // Same machine as serverURL
+const uint16_t streamPort = 5001;          // INGEST_PORT of the Python service (0 = HTTP POST only)
+const unsigned long STREAM_RESPONSE_TIMEOUT = 8000; // ms to wait for a frame result (service verify timeout is 5 s)
+const unsigned long STREAM_RETRY_MIN = 1000;        // ms before retrying a failed stream connect
+const unsigned long STREAM_RETRY_MAX = 30000;       // Backoff doubles up to this
+#define RESULT_HEADER_SIZE 5
+#define RESULT_RECORD_SIZE 24
+#define RESULT_MAX_RECORDS 8
 
 // IR Sensor Pin
 // IR sensor typically: LOW when object detected, HIGH when no object
@@ -59,6 +70,16 @@ const unsigned long DETECTION_TIMEOUT = 5000; // Stop streaming after 5 seconds
 const unsigned long FRAME_INTERVAL = 100; // Send frame every 100ms (10 FPS)
 
 HTTPClient http;
+WiFiClient streamClient;
+unsigned long lastStreamAttempt = 0;
+unsigned long streamRetryDelay = 0;  // 0 = connect right away
+
+// Outcome of sending a frame over the stream
+enum StreamResult {
+  STREAM_DONE,         // Result received
+  STREAM_NOT_SENT,     // Stream unavailable, frame not delivered (HTTP fallback is safe)
+  STREAM_NO_RESULT     // Frame delivered but no result; the service still processes it
+};
 
 void setup() {
   Serial.begin(115200);
@@ -185,6 +206,122 @@ void notifyPersonDetected() {
   http.end();
 }
 
+bool ensureStreamConnected() {
+  if (streamPort == 0) {
+    return false;
+  }
+  if (streamClient.connected()) {
+    return true;
+  }
+  
+  // Back off while the ingest is down instead of a blocking connect every frame
+  if (streamRetryDelay > 0 && millis() - lastStreamAttempt < streamRetryDelay) {
+    return false;
+  }
+  lastStreamAttempt = millis();
+  if (!streamClient.connect(streamHost, streamPort)) {
+    streamRetryDelay = streamRetryDelay == 0 ? STREAM_RETRY_MIN : min(streamRetryDelay * 2, STREAM_RETRY_MAX);
+    return false;
+  }
+  streamRetryDelay = 0;
+  streamClient.setNoDelay(true);
+  
+  // Identify this camera once per connection and ask for binary results
+  streamClient.print("HELLO ");
+  streamClient.print(cameraId);
+  streamClient.print(" binary\n");
+  Serial.println("Frame stream connected");
+  return true;
+}
+
+bool readStreamBytes(uint8_t* buffer, size_t length) {
+  size_t received = 0;
+  unsigned long start = millis();
+  
+  while (received < length) {
+    if (!streamClient.connected() || millis() - start > STREAM_RESPONSE_TIMEOUT) {
+      return false;
+    }
+    int available = streamClient.available();
+    if (available > 0) {
+      received += streamClient.read(buffer + received, min((size_t)available, length - received));
+    } else {
+      delay(1);
+    }
+  }
+  return true;
+}
+
+StreamResult sendFrameOverStream(camera_fb_t* fb) {
+  if (!ensureStreamConnected()) {
+    return STREAM_NOT_SENT;
+  }
+  
+  // Length-prefixed frame (4-byte big-endian length, then JPEG bytes)
+  uint8_t header[4] = {
+    (uint8_t)(fb->len >> 24), (uint8_t)(fb->len >> 16),
+    (uint8_t)(fb->len >> 8), (uint8_t)(fb->len)
+  };
+  if (streamClient.write(header, 4) != 4 || streamClient.write(fb->buf, fb->len) != fb->len) {
+    streamClient.stop();  // A partial frame is discarded by the service
+    return STREAM_NOT_SENT;
+  }
+  
+  // Result comes back on the same connection, also length-prefixed
+  uint8_t responseHeader[4];
+  if (!readStreamBytes(responseHeader, 4)) {
+    streamClient.stop();
+    return STREAM_NO_RESULT;
+  }
+  uint32_t responseLength = ((uint32_t)responseHeader[0] << 24) | ((uint32_t)responseHeader[1] << 16) |
+                            ((uint32_t)responseHeader[2] << 8) | responseHeader[3];
+  
+  uint8_t response[RESULT_HEADER_SIZE + RESULT_MAX_RECORDS * RESULT_RECORD_SIZE];
+  if (responseLength < RESULT_HEADER_SIZE || responseLength > sizeof(response) ||
+      !readStreamBytes(response, responseLength)) {
+    streamClient.stop();
+    return STREAM_NO_RESULT;
+  }
+  printFrameResult(response, responseLength);
+  return STREAM_DONE;
+}
+
+// Binary frame result (little-endian, see pack_frame_result in the Python service)
+//   header: uint8 version, uint16 status, uint8 faces detected, uint8 record count
+//   record: uint8 decision, uint8 flags (1 recognized, 2 verified, 4 eligible),
+//           uint8 confidence %, char name[21]
+void printFrameResult(const uint8_t* data, size_t length) {
+  uint16_t status = data[1] | (data[2] << 8);
+  uint8_t facesDetected = data[3];
+  uint8_t records = data[4];
+  
+  if (status != 200) {
+    Serial.print("Frame rejected: ");
+    Serial.println(status);
+    return;
+  }
+  
+  for (uint8_t i = 0; i < records; i++) {
+    const uint8_t* record = data + RESULT_HEADER_SIZE + i * RESULT_RECORD_SIZE;
+    if (record + RESULT_RECORD_SIZE > data + length) {
+      break;
+    }
+    uint8_t decision = record[0];
+    uint8_t flags = record[1];
+    const char* name = (const char*)(record + 3);
+    
+    // Only act once per visit (decision 2 = committed)
+    if (decision == 2) {
+      Serial.print(name[0] ? name : "Unknown");
+      Serial.println((flags & 4) ? " - ELIGIBLE" : " - NOT ELIGIBLE");
+    }
+  }
+  
+  if (facesDetected == 0) {
+    Serial.println("No faces detected");
+  }
+}
+
 void sendVideoFrame() {
   if (WiFi.status() != WL_CONNECTED) {
     return;
@@ -197,11 +334,24 @@ void sendVideoFrame() {
     return;
   }
   
+  // Prefer the persistent stream; fall back to one HTTP POST per frame.
+  // A frame the stream already delivered is never posted again, or the
+  // service would process it (and count it towards the visit) twice.
+  StreamResult streamResult = sendFrameOverStream(fb);
+  if (streamResult != STREAM_NOT_SENT) {
+    if (streamResult == STREAM_NO_RESULT) {
+      Serial.println("No result for streamed frame");
+    }
+    esp_camera_fb_return(fb);
+    return;
+  }
+  
   // Send frame to server
   String url = String(serverURL) + "/api/hardware/video-stream";
   
   http.begin(url);
   http.addHeader("Content-Type", "image/jpeg");
+  http.addHeader("X-Camera-Id", cameraId);
   
   int httpResponseCode = http.POST((uint8_t *)fb->buf, fb->len);
   
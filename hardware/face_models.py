@@ -0,0 +1,470 @@
+"""
+Shared InsightFace model construction for the service and the detection scripts
+
+Everything that builds a FaceAnalysis goes through create_face_analyzer(),
+so the model pack, providers and detector size are defined once.
+BackgroundLoader runs slow startup steps (model load, warm-up, gallery) on a
+thread so a server can answer health checks while it gets ready.
+
+ONNX Runtime optimizes every graph when it creates a session. The optimized
+graphs are saved under MODEL_CACHE_DIR on first use, keyed by model hash,
+ONNX Runtime version, providers, session options and CPU, and later loads
+read them instead of optimizing again.
+
+Usage:
+    from face_models import create_face_analyzer, warm_up
+    face_analyzer = create_face_analyzer()
+    warm_up(face_analyzer)
+
+Compare session creation with and without the cache (also primes it):
+    python face_models.py
+
+One-off scripts use get_face_analyzer(), which borrows the running service's
+warm model through its local-only /analyze endpoint and only loads the model
+in-process when the service isn't reachable.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+MODEL_PACK = 'buffalo_l'
+DEFAULT_PROVIDERS = ('CPUExecutionProvider',)
+DEFAULT_DET_SIZE = (640, 640)
+INSIGHTFACE_ROOT = os.path.expanduser(os.getenv('INSIGHTFACE_ROOT', '~/.insightface'))
+
+# Optimized ONNX graph cache (MODEL_CACHE=false always optimizes at load)
+MODEL_CACHE_ENABLED = os.getenv('MODEL_CACHE', 'true').lower() == 'true'
+MODEL_CACHE_DIR = os.getenv('MODEL_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model_cache'))
+CACHE_FORMAT_VERSION = 1  # Bump to invalidate every cache entry
+HASH_INDEX_FILE = 'hashes.json'  # Model file hashes by path, size and mtime (skips rehashing the pack)
+
+# Running face recognition service for get_face_analyzer() (USE_FACE_SERVICE=false always loads locally)
+FACE_SERVICE_URL = os.getenv('FACE_SERVICE_URL', 'http://127.0.0.1:5000')
+USE_FACE_SERVICE = os.getenv('USE_FACE_SERVICE', 'true').lower() == 'true'
+SERVICE_PROBE_TIMEOUT = 0.5  # Seconds to wait for /ready before loading locally
+
+# How the last create_face_analyzer() call went: cache 'hit' / 'miss' / 'off' / 'error',
+# lookup_ms (hashing the models and finding the entry), optimize_ms (writing the
+# cache on a miss) and sessions_ms (creating the sessions)
+load_stats = {}
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def model_hashes(model_files):
+    """
+    SHA-256 of each model file, reusing hashes recorded in MODEL_CACHE_DIR
+
+    A recorded hash is reused while the file's size and mtime are unchanged,
+    so a cache hit doesn't read the whole model pack. Files that changed are
+    hashed again and the index is rewritten (skipped if the disk is read-only).
+    """
+    index_path = os.path.join(MODEL_CACHE_DIR, HASH_INDEX_FILE)
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = {}
+
+    hashes = {}
+    changed = False
+    for path in model_files:
+        st = os.stat(path)
+        entry = index.get(os.path.abspath(path))
+        if not entry or entry.get('size') != st.st_size or entry.get('mtime_ns') != st.st_mtime_ns:
+            entry = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': file_sha256(path)}
+            index[os.path.abspath(path)] = entry
+            changed = True
+        hashes[path] = entry['sha256']
+
+    if changed:
+        try:
+            os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+            fd, scratch_path = tempfile.mkstemp(prefix='.hashes-', dir=MODEL_CACHE_DIR)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(index, f, indent=2)
+            os.replace(scratch_path, index_path)
+        except OSError:
+            pass
+    return hashes
+
+def optimization_options():
+    """Session options the cached graphs are optimized with (part of the cache key)"""
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return options
+
+def cpu_features():
+    """
+    Fingerprint of this CPU's instruction set extensions
+
+    A hash of the /proc/cpuinfo flags (Features on ARM). platform.processor()
+    is empty on Linux, so it can't tell two x86_64 CPUs apart on its own.
+    """
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith(('flags', 'Features')):
+                    flags = sorted(set(line.split(':', 1)[1].split()))
+                    return hashlib.sha256(' '.join(flags).encode()).hexdigest()[:16]
+    except OSError:
+        pass
+    return platform.processor()
+
+def cache_key(model_files, providers):
+    """
+    Cache entry name for a model pack
+
+    ORT_ENABLE_ALL includes layout optimizations for the CPU it runs on, so
+    the architecture and instruction set extensions are part of the key along
+    with the model hashes, ORT version, providers and optimization level.
+    """
+    import onnxruntime as ort
+
+    key = {
+        'format': CACHE_FORMAT_VERSION,
+        'models': {os.path.basename(path): digest for path, digest in model_hashes(model_files).items()},
+        'onnxruntime': ort.__version__,
+        'providers': list(providers),
+        'graph_optimization_level': str(optimization_options().graph_optimization_level),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_features': cpu_features()
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16], key
+
+def optimized_model_root(name, providers):
+    """
+    Root directory with optimized copies of the model pack, built on a miss
+
+    Returns:
+        (root laid out like ~/.insightface for FaceAnalysis(root=...), 'hit' or 'miss',
+         ms spent on the key and lookup, ms spent optimizing)
+    """
+    import onnxruntime as ort
+    from insightface.utils import ensure_available
+
+    start = time.perf_counter()
+    model_dir = ensure_available('models', name, root=INSIGHTFACE_ROOT)
+    model_files = sorted(
+        os.path.join(model_dir, file_name) for file_name in os.listdir(model_dir)
+        if file_name.endswith('.onnx')
+    )
+    key, key_fields = cache_key(model_files, providers)
+    entry_dir = os.path.join(MODEL_CACHE_DIR, f"{name}-{key}")
+    lookup_ms = (time.perf_counter() - start) * 1000
+    if os.path.isdir(entry_dir):
+        return entry_dir, 'hit', lookup_ms, 0.0
+
+    # Build in a scratch directory and rename it into place, so concurrent
+    # builders (e.g. detect_batch.py workers) never see a half-written entry
+    start = time.perf_counter()
+    os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+    scratch_dir = tempfile.mkdtemp(prefix=f".{name}-", dir=MODEL_CACHE_DIR)
+    try:
+        pack_dir = os.path.join(scratch_dir, 'models', name)
+        os.makedirs(pack_dir)
+        for model_file in model_files:
+            options = optimization_options()
+            options.optimized_model_filepath = os.path.join(pack_dir, os.path.basename(model_file))
+            ort.InferenceSession(model_file, sess_options=options, providers=list(providers))
+        with open(os.path.join(scratch_dir, 'key.json'), 'w') as f:
+            json.dump(key_fields, f, indent=2)
+        try:
+            os.rename(scratch_dir, entry_dir)
+        except OSError:
+            if not os.path.isdir(entry_dir):
+                raise
+            shutil.rmtree(scratch_dir, ignore_errors=True)  # Another process finished first
+    except Exception:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+        raise
+    return entry_dir, 'miss', lookup_ms, (time.perf_counter() - start) * 1000
+
+def load_face_analysis(model_dir, providers, sess_options):
+    """
+    FaceAnalysis over the models in model_dir, with sessions created using sess_options
+
+    InsightFace's model_zoo.get_model() only forwards the providers to the
+    sessions (sess_options is dropped, e.g. in 0.7.3), so each session is made
+    through ModelRouter and the FaceAnalysis is put together the way its
+    constructor does it.
+    """
+    from insightface.app import FaceAnalysis
+    from insightface.model_zoo.model_zoo import ModelRouter
+
+    face_analyzer = FaceAnalysis.__new__(FaceAnalysis)
+    face_analyzer.model_dir = model_dir
+    face_analyzer.models = {}
+    for file_name in sorted(os.listdir(model_dir)):
+        if not file_name.endswith('.onnx'):
+            continue
+        router = ModelRouter(os.path.join(model_dir, file_name))
+        model = router.get_model(providers=list(providers), sess_options=sess_options)
+        if model is not None and model.taskname not in face_analyzer.models:
+            face_analyzer.models[model.taskname] = model
+    if 'detection' not in face_analyzer.models:
+        raise RuntimeError(f"No detection model in {model_dir}")
+    face_analyzer.det_model = face_analyzer.models['detection']
+    return face_analyzer
+
+def create_face_analyzer(det_size=DEFAULT_DET_SIZE, providers=DEFAULT_PROVIDERS, name=MODEL_PACK, cache=None):
+    """
+    Load and prepare the InsightFace model pack
+
+    Args:
+        cache: Use the optimized graph cache (default: MODEL_CACHE_ENABLED)
+
+    Sessions come from the optimized graph cache when enabled; if the cache
+    can't be used (e.g. read-only disk) the original models are loaded.
+    Raises whatever InsightFace raises if the models cannot be loaded.
+    """
+    import insightface
+    import onnxruntime as ort
+
+    cache = MODEL_CACHE_ENABLED if cache is None else cache
+    stats = {'cache': 'off', 'lookup_ms': 0.0, 'optimize_ms': 0.0, 'cache_error': None}
+    face_analyzer = None
+    if cache:
+        try:
+            cache_root, stats['cache'], stats['lookup_ms'], stats['optimize_ms'] = optimized_model_root(name, providers)
+            # Already optimized, so the sessions skip ONNX Runtime's optimizer
+            sess_options = ort.SessionOptions()
+            sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            start = time.perf_counter()
+            face_analyzer = load_face_analysis(os.path.join(cache_root, 'models', name), providers, sess_options)
+        except Exception as e:
+            stats['cache'] = 'error'
+            stats['cache_error'] = str(e)
+
+    if face_analyzer is None:
+        start = time.perf_counter()
+        face_analyzer = insightface.app.FaceAnalysis(name=name, root=INSIGHTFACE_ROOT, providers=list(providers))
+    stats['sessions_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    stats['lookup_ms'] = round(stats['lookup_ms'], 1)
+    stats['optimize_ms'] = round(stats['optimize_ms'], 1)
+    face_analyzer.prepare(ctx_id=0, det_size=tuple(det_size))
+
+    load_stats.clear()
+    load_stats.update(stats)
+    return face_analyzer
+
+class ServiceFaceAnalyzer:
+    """
+    FaceAnalysis stand-in that runs get() on the face recognition service
+
+    Images go over as PNG so the service sees exactly the same pixels; faces
+    come back as InsightFace Face objects (bbox, kps, det_score, embedding).
+    If the service fails mid-run (restart, error response) the model is loaded
+    in-process once and every later call uses it.
+    """
+
+    def __init__(self, url=FACE_SERVICE_URL, timeout=30):
+        import requests
+
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.local = None  # In-process FaceAnalysis after falling back
+
+    def get(self, img):
+        """Analyze an RGB image, like FaceAnalysis.get()"""
+        import cv2
+        import requests
+        from insightface.app.common import Face
+
+        if self.local is not None:
+            return self.local.get(img)
+
+        ok, encoded = cv2.imencode('.png', cv2.cvtColor(img, cv2.COLOR_RGB2BGR))
+        if not ok:
+            raise ValueError('Could not encode image')
+
+        try:
+            response = self.session.post(
+                f"{self.url}/analyze",
+                data=encoded.tobytes(),
+                headers={'Content-Type': 'image/png'},
+                timeout=self.timeout
+            )
+            error = None if response.status_code == 200 else f"returned {response.status_code}: {response.text[:200].strip()}"
+        except requests.RequestException as e:
+            error = str(e)
+        if error:
+            print(f"Face service /analyze failed ({error}); loading the model in-process")
+            self.local = create_face_analyzer()
+            return self.local.get(img)
+
+        return [
+            Face(
+                bbox=np.array(face['bbox'], dtype=np.float32),
+                kps=np.array(face['kps'], dtype=np.float32) if face['kps'] is not None else None,
+                det_score=face['score'],
+                embedding=np.array(face['embedding'], dtype=np.float32) if face['embedding'] is not None else None
+            )
+            for face in response.json()['faces']
+        ]
+
+def connect_face_analyzer(url=FACE_SERVICE_URL):
+    """ServiceFaceAnalyzer for the service at url if it is up and ready, else None"""
+    import requests
+
+    try:
+        response = requests.get(f"{url.rstrip('/')}/ready", timeout=SERVICE_PROBE_TIMEOUT)
+    except requests.RequestException:
+        return None
+    return ServiceFaceAnalyzer(url) if response.status_code == 200 else None
+
+def get_face_analyzer(use_service=None, det_size=DEFAULT_DET_SIZE):
+    """
+    Face analyzer for one-off scripts: the running service if reachable,
+    otherwise the model loaded in-process
+
+    Args:
+        use_service: Try the service first (default: USE_FACE_SERVICE)
+    """
+    use_service = USE_FACE_SERVICE if use_service is None else use_service
+    if use_service and tuple(det_size) == DEFAULT_DET_SIZE:
+        face_analyzer = connect_face_analyzer()
+        if face_analyzer is not None:
+            return face_analyzer
+    return create_face_analyzer(det_size=det_size)
+
+def warm_up(face_analyzer, runs=2):
+    """
+    Run every model on synthetic input so the first real frame doesn't pay
+    for ONNX Runtime's lazy initialization (memory arenas, kernel selection)
+
+    Returns:
+        Seconds spent
+    """
+    from insightface.app.common import Face
+    from insightface.utils import face_align
+
+    start = time.perf_counter()
+    det_height, det_width = getattr(face_analyzer, 'det_size', DEFAULT_DET_SIZE)
+    frame = np.zeros((det_height, det_width, 3), dtype=np.uint8)
+
+    # A face box with the ArcFace template landmarks - enough for the
+    # recognition, landmark and attribute models to run their full path
+    face_image = np.full((112, 112, 3), 128, dtype=np.uint8)
+    template_face = Face(
+        bbox=np.array([0, 0, 112, 112], dtype=np.float32),
+        kps=face_align.arcface_dst.astype(np.float32),
+        det_score=1.0
+    )
+
+    for _ in range(runs):
+        for taskname, model in face_analyzer.models.items():
+            if taskname == 'detection':
+                model.detect(frame, max_num=0, metric='default')
+            else:
+                model.get(face_image, template_face)
+
+    return time.perf_counter() - start
+
+class BackgroundLoader:
+    """
+    Runs named startup steps in order on a background thread
+
+    status() can be read at any time (e.g. from /health); ready is set once
+    every step has succeeded. A failing step stops the sequence and is
+    reported in status().
+    """
+
+    def __init__(self, steps):
+        """
+        Args:
+            steps: List of (name, callable); a callable returning False counts as failed
+        """
+        self.steps = list(steps)
+        self.ready = threading.Event()
+        self.lock = threading.Lock()
+        self.state = 'pending'   # pending -> <step name> ... -> ready | failed
+        self.error = None
+        self.timings_ms = {}
+        self.started_at = None
+
+    def start(self):
+        """Start the steps (returns immediately)"""
+        self.started_at = time.time()
+        threading.Thread(target=self.run, name='model-loader', daemon=True).start()
+        return self
+
+    def run(self):
+        for name, step in self.steps:
+            with self.lock:
+                self.state = name
+            start = time.perf_counter()
+            try:
+                ok = step()
+                error = None if ok is not False else f'{name} failed'
+            except Exception as e:
+                error = f'{name}: {e}'
+            with self.lock:
+                self.timings_ms[name] = round((time.perf_counter() - start) * 1000, 1)
+                if error:
+                    self.state = 'failed'
+                    self.error = error
+                    return
+        with self.lock:
+            self.state = 'ready'
+        self.ready.set()
+
+    def wait(self, timeout=None):
+        """Block until ready (True) or timeout (False)"""
+        return self.ready.wait(timeout)
+
+    def status(self):
+        with self.lock:
+            return {
+                'state': self.state,
+                'ready': self.state == 'ready',
+                'error': self.error,
+                'timings_ms': dict(self.timings_ms),
+                'elapsed_s': round(time.time() - self.started_at, 1) if self.started_at else None
+            }
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare model loading (cache lookup + session creation) with and without the optimized graph cache')
+    parser.add_argument('--runs', type=int, default=3, help='Loads per variant (default: %(default)s)')
+    parser.add_argument('--clear', action='store_true', help='Delete MODEL_CACHE_DIR first (measures a cold miss)')
+    args = parser.parse_args()
+
+    if args.clear:
+        shutil.rmtree(MODEL_CACHE_DIR, ignore_errors=True)
+
+    print(f"Model cache: {MODEL_CACHE_DIR}")
+    results = {}
+    for label, cache in (('without cache', False), ('with cache', True)):
+        timings = []
+        for _ in range(args.runs):
+            create_face_analyzer(cache=cache)
+            timings.append(load_stats['lookup_ms'] + load_stats['sessions_ms'])
+            if load_stats['cache'] == 'miss':
+                print(f"  cache miss: optimized and saved the graphs in {load_stats['optimize_ms']:.0f} ms")
+            elif load_stats['cache'] == 'error':
+                print(f"  cache unavailable: {load_stats['cache_error']}")
+        results[label] = min(timings)
+        print(f"Model load {label:<14} best {min(timings):8.1f} ms  (runs: {', '.join(f'{t:.0f}' for t in timings)})")
+
+    if results['with cache']:
+        print(f"Speedup: {results['without cache'] / results['with cache']:.1f}x")
+
+if __name__ == "__main__":
+    main()
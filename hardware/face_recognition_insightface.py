@@ -6,34 +6,178 @@ Run:
     python face_recognition_insightface.py
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, make_response
 import cv2
-import insightface
+from insightface.app.common import Face
 import numpy as np
 import requests
 import os
 from datetime import datetime
 import onnxruntime as ort
 import threading
+import atexit
 import base64
+import bisect
+import io
+import json
 import logging
+import logging.handlers
+import math
+import re
+import shutil
+import socket
+import socketserver
+import struct
+import sys
+import time
+import queue
+import uuid
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+from types import MappingProxyType
+from urllib.parse import urlsplit
+
+import face_models
+from face_models import BackgroundLoader, create_face_analyzer, warm_up
 
 app = Flask(__name__)
 log = logging.getLogger('werkzeug')
 log.setLevel(logging.ERROR)
 
+# Service log: records are handed to a queue and written by a background
+# thread, so request threads never block on stdout
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()  # DEBUG = every per-frame message
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'kv').lower()  # 'kv' (key=value pairs) or 'json', one record per line
+LOG_RATE_LIMITS = {
+    # event -> (messages per second, keep 1 in N) for per-frame messages at INFO
+    'frame_faces': (float(os.getenv('LOG_FRAME_RATE', 1.0)), int(os.getenv('LOG_FRAME_SAMPLE', 1))),
+    'frame_match': (float(os.getenv('LOG_FRAME_RATE', 1.0)), int(os.getenv('LOG_FRAME_SAMPLE', 1))),
+}
+FRAME_FACES_EVENT = {'event': 'frame_faces'}  # Detection count per frame
+FRAME_MATCH_EVENT = {'event': 'frame_match'}  # Recognition result per face
+
+class RateLimitFilter(logging.Filter):
+    """
+    Per-event sampling and rate limiting for records tagged with extra={'event': ...}
+    
+    Keeps 1 in N records of an event, then at most `rate` per second (token
+    bucket holding at least one token, so rates below 1/s still let a record
+    through). The next record that gets through carries how many were
+    suppressed in its `suppressed` field.
+    Untagged records and everything at DEBUG level pass untouched.
+    """
+    
+    def __init__(self, limits):
+        super().__init__()
+        self.limits = limits
+        self.state = {}  # event -> [tokens, last refill, seen, suppressed]
+        self.lock = threading.Lock()
+    
+    def filter(self, record):
+        event = getattr(record, 'event', None)
+        if event not in self.limits or logger.isEnabledFor(logging.DEBUG):
+            return True
+        
+        rate, sample = self.limits[event]
+        now = time.monotonic()
+        with self.lock:
+            capacity = max(1.0, rate)
+            state = self.state.setdefault(event, [capacity, now, 0, 0])
+            state[0] = min(capacity, state[0] + (now - state[1]) * rate)
+            state[1] = now
+            state[2] += 1
+            
+            if state[2] % max(1, sample) != 0 or state[0] < 1:
+                state[3] += 1
+                return False
+            
+            state[0] -= 1
+            suppressed, state[3] = state[3], 0
+        
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+class StructuredFormatter(logging.Formatter):
+    """
+    One record per line with time, level, event, camera, msg and suppressed
+    (fields that aren't set are left out), as key=value pairs or JSON
+    
+    event and camera come from extra={'event': ..., 'camera': ...}.
+    """
+    
+    def __init__(self, as_json=False):
+        super().__init__()
+        self.as_json = as_json
+    
+    def format(self, record):
+        fields = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname.lower(),
+            'event': getattr(record, 'event', None),
+            'camera': getattr(record, 'camera', None),
+            'msg': record.getMessage(),
+            'suppressed': getattr(record, 'suppressed', None)
+        }
+        if record.exc_info:
+            fields['exc'] = self.formatException(record.exc_info)
+        fields = {key: value for key, value in fields.items() if value is not None}
+        
+        if self.as_json:
+            return json.dumps(fields, ensure_ascii=False)
+        return ' '.join(f"{key}={self.quote(value)}" for key, value in fields.items())
+    
+    @staticmethod
+    def quote(value):
+        """Bare value if it has no spaces, quotes or '=', else a JSON string"""
+        value = str(value)
+        if value and not any(c in value for c in ' "=\\\n'):
+            return value
+        return json.dumps(value, ensure_ascii=False)
+
+def configure_logging():
+    """Route the service logger through a queue to a background stdout writer"""
+    log_queue = queue.SimpleQueue()
+    
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(LOG_RATE_LIMITS))
+    
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(StructuredFormatter(as_json=(LOG_FORMAT == 'json')))
+    
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    
+    service_logger = logging.getLogger('face_service')
+    service_logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+    service_logger.addHandler(queue_handler)
+    service_logger.propagate = False
+    return service_logger
+
+logger = configure_logging()
+
 # Initialize InsightFace
 face_analyzer = None
-known_face_embeddings = {}  # Dictionary: face_id -> embedding array
+startup_loader = None  # BackgroundLoader for models + gallery (set in __main__)
 
 # Store latest frame and detection results for video viewer
 latest_frame_buffer = None
 latest_detection_results = []
+latest_frame_seq = 0  # Increases by one for every frame published to viewers
+latest_frame_time = None  # When the latest frame was published
+latest_frame_payload = (0, None)  # (seq, encoded /api/frames/latest body) - built once per frame
+latest_frame_render = None  # (decoded image, faces, results) of the latest frame, drawn on demand
 frame_lock = threading.Lock()
-latest_annotated_image = None
+frame_condition = threading.Condition(frame_lock)  # Notified when a new frame is published
+latest_annotated_image = (0, None)  # (seq, annotated image) - rendered at most once per frame
+annotation_lock = threading.Lock()
+STREAM_KEEPALIVE_SECONDS = 15  # Idle viewer streams get a keepalive (or the last frame again) this often
+MAX_LONG_POLL_SECONDS = 30  # Upper bound for ?wait= on /api/frames/latest
 
-# OpenCV window for real-time display
-SHOW_WINDOW = True
+# OpenCV window for real-time display (SHOW_WINDOW=false for headless servers)
+SHOW_WINDOW = os.getenv('SHOW_WINDOW', 'true').lower() == 'true'
+WINDOW_EVENT_INTERVAL = 0.25  # Seconds between window event pumps while no frame arrives
 window_name = "ESP32-CAM Face Recognition - Live Feed"
 window_initialized = False
 window_thread_running = False
@@ -42,27 +186,440 @@ window_thread_running = False
 NEXTJS_API_URL = os.getenv('NEXTJS_API_URL', 'http://localhost:3000')
 USE_NEXTJS_VERIFICATION = os.getenv('USE_NEXTJS_VERIFICATION', 'true').lower() == 'true'
 FACE_RECOGNITION_THRESHOLD = 0.35  # Lower = more strict (0.35 is more lenient for video)
+EMBEDDING_DIM = 512  # buffalo_l recognition model (ArcFace) output size
 IMAGE_JPG_PATH = os.path.join(os.path.dirname(__file__), 'image.jpg')  # hardware/image.jpg
+CAMERA_CONFIG_PATH = os.getenv(
+    'CAMERA_CONFIG_PATH',
+    os.path.join(os.path.dirname(__file__), 'cameras.json')
+)  # Optional per-camera settings, keyed by X-Camera-Id
+DEFAULT_CAMERA_ID = 'default'
+MAX_CAMERAS = int(os.getenv('MAX_CAMERAS', 64))  # Distinct camera ids with their own counters/trackers
+OTHER_CAMERA_ID = 'other'  # Shared by camera ids beyond MAX_CAMERAS
+
+# Persistent stream ingest (one TCP connection per camera, length-prefixed frames)
+INGEST_PORT = int(os.getenv('INGEST_PORT', 5001))  # 0 disables the stream ingest
+MAX_STREAM_FRAME_BYTES = 1024 * 1024  # Reject anything larger than a 1 MB JPEG
+STREAM_IDLE_TIMEOUT = 30  # Seconds without a frame before the connection is dropped
+
+# Binary result format for microcontrollers (see pack_frame_result)
+BINARY_RESULT_MIMETYPE = 'application/x-face-result'
+BINARY_RESULT_VERSION = 1
+BINARY_RESULT_HEADER = struct.Struct('<BHBB')   # version, status, faces detected, result count
+BINARY_RESULT_RECORD = struct.Struct('<BBB21s') # decision, flags, confidence %, name (NUL-padded)
+BINARY_RESULT_MAX_RECORDS = 8
+BINARY_DECISION_CODES = {None: 0, 'pending': 1, 'committed': 2, 'repeat': 3}
+
+# Asynchronous frame submission (202 + result lookup/callback)
+ASYNC_WORKERS = int(os.getenv('ASYNC_WORKERS', 2))
+ASYNC_QUEUE_SIZE = int(os.getenv('ASYNC_QUEUE_SIZE', 32))  # Frames waiting for a worker
+ASYNC_RESULT_CAPACITY = 512  # Finished results kept for lookup (oldest dropped first)
+# X-Callback-URL must start with one of these (comma-separated) base URLs
+ASYNC_CALLBACK_BASE_URLS = [
+    url.strip() for url in os.getenv('ASYNC_CALLBACK_BASE_URLS', NEXTJS_API_URL).split(',') if url.strip()
+]
+
+# Face quality pre-filter (faces failing any check skip the recognition model)
+DEFAULT_QUALITY_THRESHOLDS = {
+    'enabled': True,
+    'min_det_score': 0.6,     # Detector confidence
+    'min_face_size': 40,      # Shorter box side in pixels
+    'max_yaw': 45.0,          # Estimated head turn in degrees (from landmarks)
+    'max_pitch': 40.0,        # Estimated head tilt in degrees (from landmarks)
+    'min_sharpness': 25.0,    # Variance of Laplacian on the 112x112 face crop
+}
+
+# Temporal consensus (one identity decision per visit instead of one per frame)
+DEFAULT_CONSENSUS_SETTINGS = {
+    'enabled': True,
+    'window_seconds': 1.5,      # Evidence older than this is forgotten
+    'min_frames': 3,            # Frames of evidence needed before committing
+    'min_score': FACE_RECOGNITION_THRESHOLD,  # Mean similarity needed to commit
+    'min_frame_score': 0.25,    # Frames below this don't count as evidence
+    'visit_gap_seconds': 3.0,   # Person has left after not being seen this long
+    'verification_retry_seconds': 2.0,  # Wait between retries of a failed Next.js verification
+}
+
+# Per-camera flight recorder (last few seconds of frames, dumped on demand for replay)
+RECORD_SECONDS = float(os.getenv('RECORD_SECONDS', 10))  # 0 disables recording
+RECORD_BUFFER_BYTES = int(os.getenv('RECORD_BUFFER_MB', 8)) * 1024 * 1024  # Max JPEG bytes kept per camera
+RECORD_INITIAL_BYTES = 256 * 1024  # Buffers start this small and double when RECORD_SECONDS needs more
+RECORD_MAX_FRAMES = int(os.getenv('RECORD_MAX_FRAMES', 300))  # Frame slots per camera
+RECORD_MAX_CAMERAS = int(os.getenv('RECORD_MAX_CAMERAS', 16))  # Cameras recorded at once
+RECORD_IDLE_SECONDS = 300  # Recorders of cameras silent this long are dropped
+REPLAY_SCORE_TOLERANCE = 1e-3  # Similarity difference replay still counts as the same recognition
+RECORDINGS_DIR = os.getenv(
+    'RECORDINGS_DIR',
+    os.path.join(os.path.dirname(__file__), 'recordings')
+)
+
+# On-demand sampling profiler (/admin/profile) - off unless enabled
+PROFILER_ENABLED = os.getenv('PROFILER_ENABLED', 'false').lower() == 'true'
+PROFILER_TOKEN = os.getenv('PROFILER_TOKEN')  # If set, remote callers may use it via X-Admin-Token
+PROFILER_MAX_SECONDS = 60
+PROFILER_MAX_HZ = 1000
+# Leaf frames of parked threads: whole stdlib modules, or module:function
+PROFILER_IDLE_FRAMES = {'threading.py', 'queue.py', 'selectors.py', 'socket.py', 'socketserver.py',
+                        'ssl.py', 'handlers.py:dequeue'}
+
+# Slow-frame capture (frames over the latency budget are saved for offline analysis)
+SLOW_FRAME_BUDGET_MS = float(os.getenv('SLOW_FRAME_BUDGET_MS', 0))  # 0 disables capture
+SLOW_FRAME_DIR = os.getenv(
+    'SLOW_FRAME_DIR',
+    os.path.join(os.path.dirname(__file__), 'slow_frames')
+)
+SLOW_FRAME_MAX_BYTES = int(os.getenv('SLOW_FRAME_MAX_MB', 200)) * 1024 * 1024  # Oldest captures deleted beyond this
+SLOW_FRAME_QUEUE_SIZE = 16  # Captures waiting for the writer (more are dropped)
+
+camera_config = {}  # camera_id -> settings dict (loaded from CAMERA_CONFIG_PATH)
+
+def normalize_embeddings(embeddings):
+    """Stack embeddings into a float32 matrix of unit-length rows"""
+    if not embeddings:
+        return np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+    matrix = np.stack([np.asarray(e, dtype=np.float32) for e in embeddings])
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+class GallerySnapshot:
+    """
+    Immutable, versioned set of known face embeddings
+    
+    Request threads read the current snapshot without locking; writers build
+    a new snapshot and publish it with publish_gallery(). A snapshot is never
+    modified after construction, so readers can never see a half-applied update.
+    
+    The normalized matrix is a view of the first len(self) rows of a backing
+    buffer with spare capacity. Adding faces writes rows past the end (which no
+    older snapshot can see) instead of re-stacking the whole gallery.
+    """
+    
+    def __init__(self, version, embeddings, rows=None):
+        """
+        Args:
+            rows: [buffer, rows in use] shared with the snapshot this one was
+                  appended from (see with_faces); built from embeddings if None
+        """
+        self.version = version
+        self.embeddings = MappingProxyType(dict(embeddings))  # face_id -> embedding array
+        self.face_ids = tuple(self.embeddings.keys())
+        
+        if rows is None:
+            # Unit-normalized matrix so recognition is a single matrix-vector product
+            buffer = normalize_embeddings(list(self.embeddings.values()))
+            rows = [buffer, len(buffer)]
+        self.rows = rows
+        matrix = rows[0][:len(self.face_ids)]
+        matrix.setflags(write=False)
+        self.normalized_embeddings = matrix
+    
+    def __len__(self):
+        return len(self.face_ids)
+    
+    def best_match(self, embedding):
+        """
+        Find the known face most similar to an embedding
+        
+        Returns:
+            (face_id, cosine_similarity), or (None, 0.0) if nothing scores above 0
+        """
+        if not self.face_ids:
+            return None, 0.0
+        
+        query = np.asarray(embedding, dtype=np.float32)
+        query_norm = np.linalg.norm(query)
+        if query_norm == 0:
+            return None, 0.0
+        
+        similarities = self.normalized_embeddings @ (query / query_norm)
+        best_index = int(np.argmax(similarities))
+        best_score = float(similarities[best_index])
+        
+        if best_score <= 0.0:
+            return None, 0.0
+        return self.face_ids[best_index], best_score
+    
+    def with_faces(self, faces, replace=False):
+        """Return the next version with faces added (or the gallery replaced)"""
+        if replace:
+            return GallerySnapshot(self.version + 1, faces)
+        
+        embeddings = dict(self.embeddings)
+        embeddings.update(faces)
+        
+        buffer, used = self.rows
+        if used != len(self.face_ids) or any(face_id in self.embeddings for face_id in faces):
+            # Changed rows would show through older snapshots, and another
+            # snapshot may already have appended past this one: rebuild
+            return GallerySnapshot(self.version + 1, embeddings)
+        
+        added = normalize_embeddings(list(faces.values()))
+        total = used + len(faces)
+        if total > len(buffer):
+            grown = np.empty((max(total, 2 * len(buffer)), EMBEDDING_DIM), dtype=np.float32)
+            grown[:used] = buffer[:used]
+            buffer = grown
+            rows = [buffer, total]
+        else:
+            rows = self.rows
+            rows[1] = total
+        buffer[used:total] = added
+        return GallerySnapshot(self.version + 1, embeddings, rows)
+
+# Current gallery snapshot - read it with a plain attribute access, write it
+# only through publish_gallery()
+gallery = GallerySnapshot(0, {})
+gallery_write_lock = threading.Lock()
+
+# Metrics (exposed in Prometheus text format on /metrics)
+METRIC_STAGES = ('decode', 'detection', 'recognition', 'gallery_search', 'verify', 'annotation')
+LATENCY_BUCKETS_SECONDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram (seconds), rendered as a Prometheus histogram"""
+    
+    def __init__(self, buckets=LATENCY_BUCKETS_SECONDS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)  # Per bucket, made cumulative on render
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+    
+    def observe(self, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            if index < len(self.buckets):
+                self.bucket_counts[index] += 1
+            self.count += 1
+            self.sum += seconds
+    
+    def render(self, name, labels):
+        with self.lock:
+            bucket_counts = list(self.bucket_counts)
+            count, total = self.count, self.sum
+        
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, bucket_counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {count}')
+        lines.append(f'{name}_sum{{{labels}}} {total:.6f}')
+        lines.append(f'{name}_count{{{labels}}} {count}')
+        return lines
+
+stage_histograms = {stage: LatencyHistogram() for stage in METRIC_STAGES}
+frame_counters = {}  # camera_id -> {'received', 'processed', 'dropped'}
+frame_counters_lock = threading.Lock()
+
+# Per-request tracing (trace id + stage durations for the Server-Timing header)
+TRACE_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+request_trace = threading.local()
+
+class RequestTrace:
+    """Stage durations of one request, keyed by stage name (repeated stages add up)"""
+    
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+        self.start = time.perf_counter()
+        self.stages = {}
+    
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+    
+    def timings_ms(self):
+        """Stage durations plus 'total' and 'other' (time not in any stage) in ms"""
+        total = time.perf_counter() - self.start
+        timings = {stage: round(seconds * 1000, 2) for stage, seconds in self.stages.items()}
+        timings['other'] = round(max(0.0, total - sum(self.stages.values())) * 1000, 2)
+        timings['total'] = round(total * 1000, 2)
+        return timings
+    
+    def server_timing(self):
+        return ', '.join(f'{stage};dur={ms}' for stage, ms in self.timings_ms().items())
+
+@contextmanager
+def trace_request(trace_id=None):
+    """Collect stage durations for the current thread's request"""
+    trace = RequestTrace(trace_id or uuid.uuid4().hex[:16])
+    request_trace.current = trace
+    try:
+        yield trace
+    finally:
+        request_trace.current = None
+
+def current_trace():
+    """RequestTrace of the request running on this thread, if any"""
+    return getattr(request_trace, 'current', None)
+
+def incoming_trace_id():
+    """Caller-supplied X-Trace-Id if it is well-formed, else None (a new one is generated)"""
+    trace_id = request.headers.get('X-Trace-Id', '')
+    return trace_id if TRACE_ID_PATTERN.match(trace_id) else None
+
+def with_trace_headers(response, trace):
+    """Attach X-Trace-Id and Server-Timing to a Flask response"""
+    response.headers['X-Trace-Id'] = trace.trace_id
+    response.headers['Server-Timing'] = trace.server_timing()
+    return response
+
+def trace_headers():
+    """Headers that propagate the current trace id to Next.js calls"""
+    trace = current_trace()
+    return {'X-Trace-Id': trace.trace_id} if trace else {}
+
+def record_stage(stage, seconds):
+    """Record a stage duration in its histogram and in the current request trace"""
+    histogram = stage_histograms.get(stage)
+    if histogram:
+        histogram.observe(seconds)
+    trace = current_trace()
+    if trace:
+        trace.add(stage, seconds)
+
+@contextmanager
+def time_stage(stage):
+    """Record how long the enclosed block takes (histogram + request trace)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+profiler_lock = threading.Lock()  # One profile at a time
+
+def is_local_request():
+    """True when the current request comes from this machine"""
+    return request.remote_addr in ('127.0.0.1', '::1')
+
+def collapse_stack(frame):
+    """Frame chain as root-first 'func (file:line)' entries"""
+    entries = []
+    while frame is not None:
+        code = frame.f_code
+        entries.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    entries.reverse()
+    return entries
+
+def sample_stacks(seconds, hz, include_idle=False):
+    """
+    Statistical profile of every Python thread
+    
+    Samples sys._current_frames() hz times a second for seconds. Nothing is
+    installed in the profiled threads, so overhead is limited to the sampling
+    thread itself and disappears when the profile ends.
+    
+    Args:
+        include_idle: Keep samples of threads parked in stdlib waits (locks,
+                      queues, sockets); by default only busy stacks are kept
+        
+    Returns:
+        (Counter of collapsed stack -> samples, number of sampling rounds)
+    """
+    counts = Counter()
+    interval = 1.0 / hz
+    own_thread = threading.get_ident()
+    deadline = time.perf_counter() + seconds
+    rounds = 0
+    
+    while time.perf_counter() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_thread:
+                continue
+            if not include_idle:
+                module = os.path.basename(frame.f_code.co_filename)
+                if module in PROFILER_IDLE_FRAMES or f"{module}:{frame.f_code.co_name}" in PROFILER_IDLE_FRAMES:
+                    continue
+            stack = [names.get(ident, f'thread-{ident}')] + collapse_stack(frame)
+            counts[';'.join(stack)] += 1
+        rounds += 1
+        time.sleep(interval)
+    
+    return counts, rounds
+
+def prometheus_label(value):
+    """Escape a label value for the Prometheus text format"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def count_frame(camera_id, outcome):
+    """Count a frame as 'received', 'processed' or 'dropped' for a camera"""
+    with frame_counters_lock:
+        counters = frame_counters.setdefault(camera_id, {'received': 0, 'processed': 0, 'dropped': 0})
+        counters[outcome] += 1
+
+def publish_gallery(faces, replace=False):
+    """
+    Build a new gallery version containing faces and make it current
+    
+    Args:
+        faces: Dictionary face_id -> embedding array
+        replace: Drop all existing faces instead of merging
+        
+    Returns:
+        The newly published GallerySnapshot
+    """
+    global gallery
+    
+    # Writers are serialized so concurrent enrolls don't lose each other's
+    # faces; readers never take this lock
+    with gallery_write_lock:
+        snapshot = gallery.with_faces(faces, replace=replace)
+        gallery = snapshot
+    return snapshot
 
 def initialize_insightface():
-    """Initialize InsightFace model"""
+    """
+    Initialize InsightFace model and warm it up
+
+    face_analyzer is only set once the warm-up inferences are done. Frame
+    handling also waits for the startup gallery (see service_ready()).
+    """
     global face_analyzer
     try:
-        face_analyzer = insightface.app.FaceAnalysis(
-            name='buffalo_l',
-            providers=['CPUExecutionProvider']
+        analyzer = create_face_analyzer()
+        warm_seconds = warm_up(analyzer)
+        logger.info(
+            f"InsightFace models loaded: cache lookup {face_models.load_stats['lookup_ms']:.0f} ms, "
+            f"sessions {face_models.load_stats['sessions_ms']:.0f} ms "
+            f"(optimized graph cache {face_models.load_stats['cache']}), warm-up {warm_seconds * 1000:.0f} ms"
         )
-        face_analyzer.prepare(ctx_id=0, det_size=(640, 640))
+        if face_models.load_stats['cache_error']:
+            logger.warning(f"Optimized graph cache unavailable: {face_models.load_stats['cache_error']}")
+        face_analyzer = analyzer
         return True
     except Exception as e:
         import traceback
         traceback.print_exc()
         return False
 
-def load_enrolled_faces_from_database():
-    """Load enrolled faces from Next.js database via API"""
-    global known_face_embeddings
+def service_ready():
+    """
+    True once the models are warm and, when started through the background
+    loader, the startup gallery is loaded too
+
+    Until then frames get a 503 rather than being matched against an empty gallery.
+    """
+    if face_analyzer is None:
+        return False
+    return startup_loader is None or startup_loader.ready.is_set()
+
+def load_startup_gallery(update_face_ids=True):
+    """Load enrolled faces from the database, falling back to image.jpg"""
+    if not load_enrolled_faces_from_database(update_face_ids):
+        load_face_from_image_jpg()
+    return True
+
+def load_enrolled_faces_from_database(update_face_ids=True):
+    """
+    Load enrolled faces from Next.js database via API
     
+    Args:
+        update_face_ids: Store generated faceIds back in the database
+                         (False for read-only use such as replay)
+    """
     if face_analyzer is None:
         return False
     
@@ -77,11 +634,11 @@ def load_enrolled_faces_from_database():
         )
         
         if response.status_code != 200:
-            print(f"Failed to load enrolled faces: HTTP {response.status_code}")
+            logger.error(f"Failed to load enrolled faces: HTTP {response.status_code}")
             return False
         
         students = response.json()
-        loaded_count = 0
+        loaded_faces = {}
         
         for student in students:
             student_id = student.get('id')
@@ -126,11 +683,10 @@ def load_enrolled_faces_from_database():
                 embedding = face.embedding
                 
                 # Store with face_id (use existing faceId or generated one)
-                known_face_embeddings[face_id] = embedding
-                loaded_count += 1
+                loaded_faces[face_id] = embedding
                 
                 # Update faceId in database if it was generated
-                if not student.get('faceId'):
+                if update_face_ids and not student.get('faceId'):
                     try:
                         requests.put(
                             f'{NEXTJS_API_URL}/api/hardware/update-face-id',
@@ -147,19 +703,21 @@ def load_enrolled_faces_from_database():
                 # Skip this student if there's an error
                 continue
         
-        print(f"Loaded {loaded_count} enrolled face(s) from database")
-        return loaded_count > 0
+        # Publish all faces as a single new gallery version
+        if loaded_faces:
+            publish_gallery(loaded_faces)
+        
+        logger.info(f"Loaded {len(loaded_faces)} enrolled face(s) from database")
+        return len(loaded_faces) > 0
         
     except Exception as e:
-        print(f"Error loading enrolled faces: {e}")
+        logger.error(f"Error loading enrolled faces: {e}")
         import traceback
         traceback.print_exc()
         return False
 
 def load_face_from_image_jpg():
     """Load face embedding from image.jpg in project root (fallback)"""
-    global known_face_embeddings
-    
     if face_analyzer is None:
         return False
     
@@ -188,9 +746,9 @@ def load_face_from_image_jpg():
         
         # Store with face_id "enrolled_user"
         face_id = "enrolled_user"
-        known_face_embeddings[face_id] = embedding
+        publish_gallery({face_id: embedding})
         
-        print(f"Face loaded from image.jpg (embedding size: {len(embedding)})")
+        logger.info(f"Face loaded from image.jpg (embedding size: {len(embedding)})")
         return True
         
     except Exception as e:
@@ -198,104 +756,1072 @@ def load_face_from_image_jpg():
         traceback.print_exc()
         return False
 
-def detect_and_recognize_faces(image_buffer):
+def load_camera_config():
     """
-    Detect and recognize faces in an image buffer using InsightFace
+    Load per-camera settings from CAMERA_CONFIG_PATH
     
-    Args:
-        image_buffer: JPEG image bytes
-        
-    Returns:
-        List of detected faces with recognition results
+    File format (all keys optional; "default" applies to every camera):
+        {
+            "default":   {"quality": {"min_face_size": 40}},
+            "counter-1": {"quality": {"min_face_size": 60, "max_yaw": 30},
+                          "roi": {"x": 80, "y": 40, "width": 480, "height": 400}}
+        }
     """
+    global camera_config
+    
+    if not os.path.exists(CAMERA_CONFIG_PATH):
+        return False
+    
     try:
-        # Convert buffer to numpy array
-        nparr = np.frombuffer(image_buffer, np.uint8)
-        
-        # Decode image
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        if image is None:
-            return []
-        
-        # Convert BGR to RGB
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        with open(CAMERA_CONFIG_PATH) as f:
+            loaded_config = json.load(f)
         
-        # Detect faces and extract embeddings
-        faces = face_analyzer.get(rgb_image)
-        
-        if len(faces) == 0:
-            print("person not detected")
-            return []
+        for settings in loaded_config.values():
+            if settings.get('roi'):
+                settings['roi'] = parse_roi(settings['roi'])
         
-        # Print detection count
-        if len(faces) == 1:
-            print("person detected")
+        camera_config = loaded_config
+        with known_cameras_lock:
+            known_cameras.update(loaded_config)
+        logger.info(f"Loaded camera config for {len(camera_config)} camera(s) from {CAMERA_CONFIG_PATH}")
+        return True
+    except Exception as e:
+        logger.error(f"Error loading camera config: {e}")
+        return False
+
+known_cameras = set()  # Camera ids that have their own per-camera state
+known_cameras_lock = threading.Lock()
+
+def tracked_camera_id(camera_id):
+    """
+    Camera id to key per-camera state by (counters, quality stats, visit
+    trackers, recorders, metric labels)
+    
+    Ids come from clients, so only cameras in cameras.json and the first
+    MAX_CAMERAS other ids get their own entry; the rest share OTHER_CAMERA_ID.
+    """
+    if camera_id in known_cameras:
+        return camera_id
+    with known_cameras_lock:
+        if camera_id in known_cameras or len(known_cameras) < MAX_CAMERAS:
+            known_cameras.add(camera_id)
+            return camera_id
+    return OTHER_CAMERA_ID
+
+def get_camera_id():
+    """Camera ID of the current request (ESP32 sends X-Camera-Id), see tracked_camera_id()"""
+    return tracked_camera_id(request.headers.get('X-Camera-Id') or request.args.get('camera') or DEFAULT_CAMERA_ID)
+
+def get_camera_settings(camera_id, section, defaults):
+    """Settings section for a camera: built-in defaults < "default" section < camera section"""
+    config = camera_config
+    settings = dict(defaults)
+    settings.update(config.get(DEFAULT_CAMERA_ID, {}).get(section, {}))
+    settings.update(config.get(camera_id, {}).get(section, {}))
+    return settings
+
+def get_quality_thresholds(camera_id):
+    """Quality thresholds for a camera"""
+    return get_camera_settings(camera_id, 'quality', DEFAULT_QUALITY_THRESHOLDS)
+
+def get_consensus_settings(camera_id):
+    """Temporal consensus settings for a camera"""
+    return get_camera_settings(camera_id, 'consensus', DEFAULT_CONSENSUS_SETTINGS)
+
+camera_config_lock = threading.Lock()
+
+def parse_roi(roi):
+    """Validate an ROI given as {"x", "y", "width", "height"} in frame pixels"""
+    try:
+        x, y = int(roi['x']), int(roi['y'])
+        width, height = int(roi['width']), int(roi['height'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('roi must have integer x, y, width and height')
+    
+    if x < 0 or y < 0 or width <= 0 or height <= 0:
+        raise ValueError('roi must have non-negative x/y and positive width/height')
+    
+    return {'x': x, 'y': y, 'width': width, 'height': height}
+
+def set_camera_roi(camera_id, roi):
+    """Set (or clear, with roi=None) a camera's region of interest at runtime"""
+    global camera_config
+    
+    # Copy-on-write like the gallery, so frame threads never see a partial update
+    with camera_config_lock:
+        settings = dict(camera_config.get(camera_id, {}))
+        if roi is None:
+            settings.pop('roi', None)
         else:
-            print(f"{len(faces)} persons detected")
+            settings['roi'] = roi
+        camera_config = dict(camera_config, **{camera_id: settings})
+
+def get_camera_roi_setting(camera_id):
+    """Configured ROI dict for a camera: camera section, else "default" section, else None"""
+    config = camera_config
+    settings = config.get(camera_id, {})
+    if 'roi' in settings:
+        return settings['roi']
+    return config.get(DEFAULT_CAMERA_ID, {}).get('roi')
+
+def get_camera_roi(camera_id, frame_width, frame_height):
+    """
+    Region of interest for a camera, clipped to the frame
+    
+    Returns:
+        (x1, y1, x2, y2) in frame pixels, or None to process the full frame
+    """
+    roi = get_camera_roi_setting(camera_id)
+    if not roi:
+        return None
+    
+    x1 = min(max(0, roi['x']), frame_width)
+    y1 = min(max(0, roi['y']), frame_height)
+    x2 = min(x1 + roi['width'], frame_width)
+    y2 = min(y1 + roi['height'], frame_height)
+    
+    if x2 <= x1 or y2 <= y1:
+        # ROI lies outside this frame (e.g. resolution changed) - don't drop the frame
+        return None
+    if (x1, y1, x2, y2) == (0, 0, frame_width, frame_height):
+        return None
+    return x1, y1, x2, y2
+
+# Quality filter counters, per camera
+quality_stats = {}
+quality_stats_lock = threading.Lock()
+recognition_time_stats = {'runs': 0, 'total_ms': 0.0}  # Used to estimate compute saved
+
+def estimate_head_pose(kps):
+    """
+    Rough yaw/pitch in degrees from the 5 detector landmarks
+    (left eye, right eye, nose, left mouth corner, right mouth corner)
+    
+    The nose sits halfway between the eyes for a frontal face and moves
+    towards one eye as the head turns; vertically it sits at a fixed ratio
+    between the eye line and the mouth line.
+    """
+    left_eye, right_eye, nose, left_mouth, right_mouth = kps[:5]
+    
+    eye_span = right_eye[0] - left_eye[0]
+    if eye_span <= 0:
+        # Eyes swapped or collapsed - extreme profile
+        return 90.0, 90.0
+    
+    yaw_ratio = (nose[0] - left_eye[0]) / eye_span  # 0.5 when frontal
+    yaw = math.degrees(math.asin(min(1.0, abs(yaw_ratio - 0.5) * 2)))
+    
+    eye_y = (left_eye[1] + right_eye[1]) / 2
+    mouth_y = (left_mouth[1] + right_mouth[1]) / 2
+    face_span = mouth_y - eye_y
+    if face_span <= 0:
+        return yaw, 90.0
+    
+    pitch_ratio = (nose[1] - eye_y) / face_span  # ~0.5 when frontal
+    pitch = math.degrees(math.asin(min(1.0, abs(pitch_ratio - 0.5) * 2)))
+    
+    return yaw, pitch
+
+def estimate_sharpness(image, bbox):
+    """Variance of Laplacian over the face crop, resized to the recognizer input size"""
+    height, width = image.shape[:2]
+    x1 = max(0, int(bbox[0]))
+    y1 = max(0, int(bbox[1]))
+    x2 = min(width, int(bbox[2]))
+    y2 = min(height, int(bbox[3]))
+    if x2 <= x1 or y2 <= y1:
+        return 0.0
+    
+    crop = cv2.cvtColor(image[y1:y2, x1:x2], cv2.COLOR_RGB2GRAY)
+    crop = cv2.resize(crop, (112, 112), interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(crop, cv2.CV_64F).var())
+
+def check_face_quality(image, face, thresholds):
+    """
+    Decide whether a detected face is worth running the recognition model on
+    
+    Checks run cheapest first so most rejects cost almost nothing.
+    
+    Returns:
+        None if the face passes, otherwise the name of the failed check
+    """
+    if float(face.det_score) < thresholds['min_det_score']:
+        return 'low_score'
+    
+    box_width = face.bbox[2] - face.bbox[0]
+    box_height = face.bbox[3] - face.bbox[1]
+    if min(box_width, box_height) < thresholds['min_face_size']:
+        return 'too_small'
+    
+    if face.kps is not None:
+        yaw, pitch = estimate_head_pose(face.kps)
+        if yaw > thresholds['max_yaw'] or pitch > thresholds['max_pitch']:
+            return 'pose'
+    
+    if estimate_sharpness(image, face.bbox) < thresholds['min_sharpness']:
+        return 'blurry'
+    
+    return None
+
+def record_quality_result(camera_id, evaluated, skipped_reasons):
+    """Update the quality filter counters for one frame"""
+    with quality_stats_lock:
+        stats = quality_stats.setdefault(camera_id, {
+            'faces_evaluated': 0,
+            'faces_passed': 0,
+            'faces_skipped': 0,
+            'skipped_by_reason': {}
+        })
+        stats['faces_evaluated'] += evaluated
+        stats['faces_passed'] += evaluated - len(skipped_reasons)
+        stats['faces_skipped'] += len(skipped_reasons)
+        for reason in skipped_reasons:
+            stats['skipped_by_reason'][reason] = stats['skipped_by_reason'].get(reason, 0) + 1
+
+def get_quality_stats():
+    """Snapshot of the quality filter counters with estimated compute saved"""
+    with quality_stats_lock:
+        cameras = {
+            camera_id: dict(stats, skipped_by_reason=dict(stats['skipped_by_reason']))
+            for camera_id, stats in quality_stats.items()
+        }
+        runs = recognition_time_stats['runs']
+        avg_recognition_ms = recognition_time_stats['total_ms'] / runs if runs else 0.0
+    
+    total_skipped = sum(stats['faces_skipped'] for stats in cameras.values())
+    return {
+        'cameras': cameras,
+        'faces_skipped': total_skipped,
+        'avg_recognition_ms': round(avg_recognition_ms, 2),
+        'estimated_compute_saved_ms': round(total_skipped * avg_recognition_ms, 1)
+    }
+
+def decode_frame(image_buffer):
+    """Decode JPEG bytes to a BGR image (None if the data isn't a valid image)"""
+    nparr = np.frombuffer(image_buffer, np.uint8)
+    return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
+def prepare_detection_input(image, camera_id=DEFAULT_CAMERA_ID):
+    """
+    Crop a decoded frame to the camera's ROI and convert it for InsightFace
+    
+    Returns:
+        (rgb_image, (offset_x, offset_y)) - add the offset to boxes found in
+        rgb_image to get full-frame coordinates
+    """
+    # Crop to the camera's region of interest so the detector only sees
+    # the part of the scene where faces can be
+    offset_x, offset_y = 0, 0
+    roi = get_camera_roi(camera_id, image.shape[1], image.shape[0])
+    if roi:
+        offset_x, offset_y, x2, y2 = roi
+        image = image[offset_y:y2, offset_x:x2]
+    
+    # Convert BGR to RGB
+    rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return rgb_image, (offset_x, offset_y)
+
+def to_bounding_box(bbox, offset=(0, 0)):
+    """[x1, y1, x2, y2] detector box -> full-frame {x, y, width, height}"""
+    x1, y1, x2, y2 = bbox.astype(int)[:4]
+    return {
+        'x': int(x1 + offset[0]),
+        'y': int(y1 + offset[1]),
+        'width': int(x2 - x1),
+        'height': int(y2 - y1)
+    }
+
+def detect_faces_only(image, camera_id=DEFAULT_CAMERA_ID):
+    """
+    Detection-only fast path: boxes and detector scores, no recognition model
+    and no gallery lookup (presence counting, PIR confirmation)
+    
+    The quality filter is applied as in recognize mode, so both modes report
+    the same faces with the same skipReason.
+    
+    Args:
+        image: Decoded BGR frame
+        camera_id: Camera the frame came from (selects ROI and quality thresholds)
         
-        results = []
+    Returns:
+        List of {'boundingBox', 'score', 'skipReason'} in full-frame coordinates
+    """
+    rgb_image, offset = prepare_detection_input(image, camera_id)
+    with time_stage('detection'):
+        bboxes, kpss = face_analyzer.det_model.detect(rgb_image, max_num=0, metric='default')
+    thresholds = get_quality_thresholds(camera_id)
+    
+    results = []
+    for i in range(bboxes.shape[0]):
+        face = Face(
+            bbox=bboxes[i, 0:4],
+            kps=kpss[i] if kpss is not None else None,
+            det_score=bboxes[i, 4]
+        )
+        results.append({
+            'boundingBox': to_bounding_box(face.bbox, offset),
+            'score': round(float(face.det_score), 4),
+            'skipReason': check_face_quality(rgb_image, face, thresholds) if thresholds['enabled'] else None
+        })
+    return results
+
+def detect_quality_faces(rgb_image, camera_id=DEFAULT_CAMERA_ID):
+    """
+    Run detection, filter faces by quality and compute embeddings for the rest
+    
+    Only the detector and the recognition model run; the landmark and
+    gender/age models that FaceAnalysis.get() would also run are skipped.
+    
+    Returns:
+        (faces, skipped) - faces have .embedding set; skipped is a list of
+        (face, reason) for faces that failed the quality filter (no embedding)
+    """
+    thresholds = get_quality_thresholds(camera_id)
+    
+    with time_stage('detection'):
+        bboxes, kpss = face_analyzer.det_model.detect(rgb_image, max_num=0, metric='default')
+    recognition_model = face_analyzer.models['recognition']
+    
+    faces = []
+    skipped = []
+    recognition_ms = 0.0
+    
+    for i in range(bboxes.shape[0]):
+        face = Face(
+            bbox=bboxes[i, 0:4],
+            kps=kpss[i] if kpss is not None else None,
+            det_score=bboxes[i, 4]
+        )
         
-        for i, face in enumerate(faces):
-            # Get face embedding (512-dimensional vector)
-            embedding = face.embedding
+        if thresholds['enabled']:
+            reason = check_face_quality(rgb_image, face, thresholds)
+            if reason:
+                skipped.append((face, reason))
+                continue
+        
+        start = time.perf_counter()
+        recognition_model.get(rgb_image, face)
+        elapsed = time.perf_counter() - start
+        record_stage('recognition', elapsed)
+        recognition_ms += elapsed * 1000
+        faces.append(face)
+    
+    record_quality_result(camera_id, bboxes.shape[0], [reason for _, reason in skipped])
+    if faces:
+        with quality_stats_lock:
+            recognition_time_stats['runs'] += len(faces)
+            recognition_time_stats['total_ms'] += recognition_ms
+    
+    return faces, skipped
+
+class VisitTracker:
+    """
+    Aggregates per-frame recognitions from one camera into one decision per visit
+    
+    Similarity scores for each candidate identity are collected over a short
+    window. Once there is enough evidence the identity is committed as a visit;
+    further frames of the same person are reported as repeats of that visit
+    until the person hasn't been seen for visit_gap_seconds.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.evidence = {}  # candidate face_id -> deque of (timestamp, similarity)
+        self.visits = {}    # face_id -> visit dict for people currently at the camera
+    
+    def observe(self, face_id, similarity, settings, now=None):
+        """
+        Add one frame's best match for a face
+        
+        Returns:
+            (decision, visit) where decision is 'committed' (first decision of a
+            new visit), 'repeat' (visit already decided) or 'pending'
+        
+        face_id is the best gallery match whatever its score, so a frame only
+        counts as (and keeps alive) a repeat when it is a plausible match too.
+        """
+        if now is None:
+            now = time.monotonic()
+        
+        with self.lock:
+            self._expire(now, settings)
             
-            # Get bounding box
-            bbox = face.bbox.astype(int)  # [x1, y1, x2, y2]
+            if similarity < settings['min_frame_score']:
+                return 'pending', None
             
-            # Recognize face by comparing with known embeddings
-            face_id = None
-            confidence = 0.0
+            visit = self.visits.get(face_id)
+            if visit:
+                visit['last_seen'] = now
+                return 'repeat', visit
             
-            if len(known_face_embeddings) > 0:
-                # Calculate cosine similarity with known faces
-                best_match_id = None
-                best_match_score = 0.0
-                
-                for known_id, known_embedding in known_face_embeddings.items():
-                    # Cosine similarity
-                    similarity = np.dot(embedding, known_embedding) / (
-                        np.linalg.norm(embedding) * np.linalg.norm(known_embedding)
-                    )
-                    
-                    if similarity > best_match_score:
-                        best_match_score = similarity
-                        best_match_id = known_id
-                
-                # If similarity is above threshold, it's a match
-                if best_match_score > FACE_RECOGNITION_THRESHOLD:
-                    face_id = best_match_id
-                    confidence = float(best_match_score)
-                    if len(faces) == 1:
-                        print(f"recognized (similarity: {best_match_score:.3f})")
-                    else:
-                        print(f"person {i+1}: recognized (similarity: {best_match_score:.3f})")
-                else:
-                    if len(faces) == 1:
-                        print(f"not recognized (similarity: {best_match_score:.3f}, threshold: {FACE_RECOGNITION_THRESHOLD})")
-                    else:
-                        print(f"person {i+1}: not recognized (similarity: {best_match_score:.3f}, threshold: {FACE_RECOGNITION_THRESHOLD})")
-            else:
-                if len(faces) == 1:
-                    print("not recognized")
-                else:
-                    print(f"person {i+1}: not recognized")
+            samples = self.evidence.setdefault(face_id, deque())
+            samples.append((now, similarity))
+            while now - samples[0][0] > settings['window_seconds']:
+                samples.popleft()
             
-            results.append({
+            if len(samples) >= settings['min_frames']:
+                mean_similarity = sum(score for _, score in samples) / len(samples)
+                if mean_similarity > settings['min_score']:
+                    del self.evidence[face_id]
+                    visit = {
+                        'faceId': face_id,
+                        'confidence': mean_similarity,
+                        'frames': len(samples),
+                        'started_at': now,
+                        'last_seen': now,
+                        'verification_done': False,  # True once verification succeeded
+                        'verification': None,
+                        'verifying': False,          # A verify call is in flight
+                        'last_verify_attempt': None
+                    }
+                    self.visits[face_id] = visit
+                    return 'committed', visit
+            
+            return 'pending', None
+    
+    def seed_visit(self, face_id, confidence, now):
+        """Open a visit that started before now (replay of a dump recorded mid-visit)"""
+        with self.lock:
+            self.visits[face_id] = {
                 'faceId': face_id,
                 'confidence': confidence,
-                'boundingBox': {
-                    'x': int(bbox[0]),
-                    'y': int(bbox[1]),
-                    'width': int(bbox[2] - bbox[0]),
-                    'height': int(bbox[3] - bbox[1])
-                },
-                'embedding': embedding.tolist()  # Include for enrollment
-            })
-        
-        return results
+                'frames': 0,
+                'started_at': now,
+                'last_seen': now,
+                'verification_done': False,
+                'verification': None,
+                'verifying': False,
+                'last_verify_attempt': None
+            }
+    
+    def begin_verification(self, visit, now, settings):
+        """
+        Claim the visit's Next.js verification call
+        
+        Returns False if it already succeeded, another frame is verifying
+        right now, or the last failed attempt was too recent.
+        """
+        if now is None:
+            now = time.monotonic()
+        
+        with self.lock:
+            if visit['verification_done'] or visit['verifying']:
+                return False
+            last_attempt = visit['last_verify_attempt']
+            if last_attempt is not None and now - last_attempt < settings['verification_retry_seconds']:
+                return False
+            visit['verifying'] = True
+            visit['last_verify_attempt'] = now
+            return True
+    
+    def finish_verification(self, visit, result):
+        """Store a verification result; failures (None) are retried on a later frame"""
+        with self.lock:
+            visit['verifying'] = False
+            if result:
+                visit['verification'] = result
+                visit['verification_done'] = True
+    
+    def _expire(self, now, settings):
+        """Forget visits of people who left and stale evidence (caller holds lock)"""
+        for face_id in [f for f, v in self.visits.items()
+                        if now - v['last_seen'] > settings['visit_gap_seconds']]:
+            del self.visits[face_id]
+        
+        for face_id in [f for f, samples in self.evidence.items()
+                        if now - samples[-1][0] > settings['window_seconds']]:
+            del self.evidence[face_id]
+
+visit_trackers = {}  # camera_id -> VisitTracker
+visit_trackers_lock = threading.Lock()
+
+def get_visit_tracker(camera_id):
+    """VisitTracker for a camera (created on first use)"""
+    tracker = visit_trackers.get(camera_id)
+    if tracker is None:
+        with visit_trackers_lock:
+            tracker = visit_trackers.setdefault(camera_id, VisitTracker())
+    return tracker
+
+class FrameRecorder:
+    """
+    Ring buffer of a camera's recent frames (JPEG bytes, time, results)
+    
+    JPEG bytes are copied into one bytearray used as a byte ring, and
+    per-frame metadata lives in fixed numpy slot arrays. Frames older than
+    window_seconds are dropped first; the bytearray starts small and only
+    doubles (up to capacity_bytes) when the window holds more than fits, so
+    a quiet camera costs little. At full size the oldest frames are
+    overwritten when either the bytes or the slots run out.
+    """
+    
+    def __init__(self, capacity_bytes=RECORD_BUFFER_BYTES, max_frames=RECORD_MAX_FRAMES,
+                 window_seconds=RECORD_SECONDS, initial_bytes=RECORD_INITIAL_BYTES):
+        self.lock = threading.Lock()
+        self.capacity_bytes = capacity_bytes
+        self.window_seconds = window_seconds
+        self.data = bytearray(min(initial_bytes, capacity_bytes))
+        self.view = memoryview(self.data)
+        self.offsets = np.zeros(max_frames, dtype=np.int64)
+        self.lengths = np.zeros(max_frames, dtype=np.int64)
+        self.timestamps = np.zeros(max_frames, dtype=np.float64)
+        self.results = [None] * max_frames
+        self.oldest = 0     # Slot of the oldest recorded frame
+        self.count = 0      # Frames currently held
+        self.write_pos = 0  # Next free byte in self.data
+        self.skipped = 0    # Frames too large for the buffer
+        self.last_recorded = time.monotonic()
+    
+    def record(self, jpeg_bytes, timestamp, results):
+        """Copy one frame into the ring (evicting the oldest frames it overlaps)"""
+        size = len(jpeg_bytes)
+        max_frames = len(self.offsets)
+        
+        with self.lock:
+            self.last_recorded = time.monotonic()
+            if size > self.capacity_bytes:
+                self.skipped += 1
+                return
+            
+            # Frames that fell out of the recording window make room first
+            while self.count and timestamp - self.timestamps[self.oldest] > self.window_seconds:
+                self._evict_oldest()
+            if not self.count:
+                self.write_pos = 0
+            
+            if len(self.data) < self.capacity_bytes and (size > len(self.data) or self._would_overwrite(size)):
+                self._grow(size)
+            capacity = len(self.data)
+            
+            start = self.write_pos
+            if start + size > capacity:
+                # Wrap around; frames in the unused tail are the oldest ones
+                while self.count and self.offsets[self.oldest] >= start:
+                    self._evict_oldest()
+                start = 0
+            end = start + size
+            
+            while self.count and (
+                self.count == max_frames or
+                (self.offsets[self.oldest] < end and
+                 self.offsets[self.oldest] + self.lengths[self.oldest] > start)
+            ):
+                self._evict_oldest()
+            
+            self.view[start:end] = jpeg_bytes
+            slot = (self.oldest + self.count) % max_frames
+            self.offsets[slot] = start
+            self.lengths[slot] = size
+            self.timestamps[slot] = timestamp
+            self.results[slot] = results
+            self.count += 1
+            self.write_pos = end
+    
+    def _would_overwrite(self, size):
+        """True if writing size bytes next would evict a frame still in the window (caller holds lock)"""
+        if not self.count:
+            return False
+        oldest_start = self.offsets[self.oldest]
+        oldest_end = oldest_start + self.lengths[self.oldest]
+        start = self.write_pos
+        if start + size > len(self.data):
+            # Wrapping drops every frame after write_pos, then writes from 0
+            if oldest_start >= start:
+                return True
+            start = 0
+        return oldest_start < start + size and oldest_end > start
+    
+    def _grow(self, size):
+        """Double the byte ring (at least enough for size more bytes), compacting frames oldest first (caller holds lock)"""
+        max_frames = len(self.offsets)
+        slots = [(self.oldest + i) % max_frames for i in range(self.count)]
+        used = int(self.lengths[slots].sum()) if slots else 0
+        data = bytearray(min(self.capacity_bytes, max(2 * len(self.data), used + size)))
+        position = 0
+        for slot in slots:
+            start, length = self.offsets[slot], self.lengths[slot]
+            data[position:position + length] = self.view[start:start + length]
+            self.offsets[slot] = position
+            position += length
+        self.view.release()
+        self.data = data
+        self.view = memoryview(data)
+        self.write_pos = position
+    
+    def _evict_oldest(self):
+        """Drop the oldest frame (caller holds lock)"""
+        self.results[self.oldest] = None
+        self.oldest = (self.oldest + 1) % len(self.offsets)
+        self.count -= 1
+    
+    def snapshot(self, seconds=None):
+        """
+        Copy out the recorded frames, oldest first
+        
+        Args:
+            seconds: Only frames from the last N seconds (default: RECORD_SECONDS)
+            
+        Returns:
+            List of (timestamp, jpeg_bytes, results)
+        """
+        if seconds is None:
+            seconds = RECORD_SECONDS
+        
+        with self.lock:
+            if not self.count:
+                return []
+            newest = (self.oldest + self.count - 1) % len(self.offsets)
+            cutoff = self.timestamps[newest] - seconds
+            frames = []
+            for i in range(self.count):
+                slot = (self.oldest + i) % len(self.offsets)
+                if self.timestamps[slot] < cutoff:
+                    continue
+                start = self.offsets[slot]
+                frames.append((
+                    float(self.timestamps[slot]),
+                    bytes(self.view[start:start + self.lengths[slot]]),
+                    self.results[slot]
+                ))
+            return frames
+    
+    def stats(self):
+        """Summary for the recording status endpoint"""
+        with self.lock:
+            newest = (self.oldest + self.count - 1) % len(self.offsets)
+            return {
+                'frames': self.count,
+                'bytes': int(self.lengths[[(self.oldest + i) % len(self.offsets) for i in range(self.count)]].sum()),
+                'allocated_bytes': len(self.data),
+                'capacity_bytes': self.capacity_bytes,
+                'capacity_frames': len(self.offsets),
+                'seconds': float(self.timestamps[newest] - self.timestamps[self.oldest]) if self.count else 0.0,
+                'skipped': self.skipped
+            }
+
+frame_recorders = {}  # camera_id -> FrameRecorder
+frame_recorders_lock = threading.Lock()
+recorder_stats = {'refused': 0, 'expired': 0}  # Cameras not recorded (at RECORD_MAX_CAMERAS) / idle recorders dropped
+
+def get_frame_recorder(camera_id):
+    """
+    FrameRecorder for a camera (created on first use)
+    
+    Camera ids come from request headers, so at most RECORD_MAX_CAMERAS
+    recorders exist; idle ones are dropped to make room for new cameras.
+    
+    Returns:
+        FrameRecorder, or None if every recorder slot is in use
+    """
+    recorder = frame_recorders.get(camera_id)
+    if recorder is None:
+        with frame_recorders_lock:
+            recorder = frame_recorders.get(camera_id)
+            if recorder is None:
+                expire_idle_recorders()
+                if len(frame_recorders) >= RECORD_MAX_CAMERAS:
+                    recorder_stats['refused'] += 1
+                    return None
+                recorder = frame_recorders[camera_id] = FrameRecorder()
+    return recorder
+
+def expire_idle_recorders():
+    """Drop recorders of cameras that sent nothing for RECORD_IDLE_SECONDS (caller holds frame_recorders_lock)"""
+    now = time.monotonic()
+    for camera_id in [c for c, r in frame_recorders.items() if now - r.last_recorded > RECORD_IDLE_SECONDS]:
+        del frame_recorders[camera_id]
+        recorder_stats['expired'] += 1
+
+def record_frame(camera_id, image_buffer, results, timestamp=None):
+    """Keep a processed frame in its camera's flight recorder"""
+    if RECORD_SECONDS <= 0:
+        return
+    recorder = get_frame_recorder(camera_id)
+    if recorder is not None:
+        recorder.record(image_buffer, timestamp or time.time(), results)
+
+def write_frame_dump(dump_dir, camera_id, frames, gallery_version, include_gallery=False, extra=None):
+    """
+    Write frames in the dump layout that replay_recording() reads
+    
+    Layout: <dump_dir>/
+        000001.jpg, 000002.jpg, ...
+        manifest.json (camera, its settings, gallery version, per-frame timestamp + results)
+        gallery.npy + gallery_ids.json (only with include_gallery; same format as /load-face/bulk)
+    
+    Args:
+        frames: List of (timestamp, jpeg_bytes, results)
+        extra: Additional manifest keys
+    """
+    os.makedirs(dump_dir, exist_ok=True)
+    
+    manifest_frames = []
+    for index, (timestamp, jpeg_bytes, results) in enumerate(frames, start=1):
+        file_name = f"{index:06d}.jpg"
+        with open(os.path.join(dump_dir, file_name), 'wb') as f:
+            f.write(jpeg_bytes)
+        manifest_frames.append({
+            'file': file_name,
+            'timestamp': timestamp,
+            'results': results
+        })
+    
+    snapshot = gallery
+    if include_gallery and len(snapshot):
+        np.save(os.path.join(dump_dir, 'gallery.npy'),
+                np.stack([snapshot.embeddings[face_id] for face_id in snapshot.face_ids]))
+        with open(os.path.join(dump_dir, 'gallery_ids.json'), 'w') as f:
+            json.dump(list(snapshot.face_ids), f)
+    
+    config = camera_config
+    manifest = {
+        'camera_id': camera_id,
+        'camera_config': {
+            key: config[key] for key in (DEFAULT_CAMERA_ID, camera_id) if key in config
+        },
+        'gallery_version': gallery_version,
+        'recorded_at': datetime.now().isoformat(),
+        'frames': manifest_frames
+    }
+    manifest.update(extra or {})
+    with open(os.path.join(dump_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+def safe_path_component(value):
+    """Camera or trace id reduced to characters that are safe in a file name"""
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', value)
+
+def dump_recording(camera_id, seconds=None, output_dir=None, include_gallery=False):
+    """
+    Write a camera's recorded frames to disk for later replay
+    
+    Goes to <output_dir>/<camera>-<YYYYmmdd-HHMMSS>/ (see write_frame_dump)
+    
+    Returns:
+        (dump directory, number of frames), or (None, 0) if nothing was recorded
+    """
+    recorder = frame_recorders.get(camera_id)
+    frames = recorder.snapshot(seconds) if recorder else []
+    if not frames:
+        return None, 0
+    
+    dump_dir = os.path.join(
+        output_dir or RECORDINGS_DIR,
+        f"{safe_path_component(camera_id)}-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+    )
+    write_frame_dump(dump_dir, camera_id, frames, gallery.version, include_gallery)
+    
+    return dump_dir, len(frames)
+
+slow_frame_queue = queue.Queue(maxsize=SLOW_FRAME_QUEUE_SIZE)
+slow_frame_stats = {'captured': 0, 'dropped': 0, 'evicted': 0}
+slow_frame_writer_started = False
+slow_frame_lock = threading.Lock()
+
+def capture_slow_frame(image_buffer, camera_id, payload, status, trace):
+    """
+    Queue a frame for capture if its request went over SLOW_FRAME_BUDGET_MS
+    
+    Called at the end of a traced frame request. The check is one comparison;
+    the disk write happens on the slow-frame writer thread, and captures are
+    dropped (counted) rather than slowing requests down when it falls behind.
+    """
+    if SLOW_FRAME_BUDGET_MS <= 0 or trace is None:
+        return
+    
+    timings = trace.timings_ms()
+    if timings['total'] <= SLOW_FRAME_BUDGET_MS:
+        return
+    
+    start_slow_frame_writer()
+    capture = {
+        'trace_id': trace.trace_id,
+        'budget_ms': SLOW_FRAME_BUDGET_MS,
+        'timings_ms': timings,
+        'status': status,
+        'faces_detected': payload.get('faces_detected', 0),
+        'queue_depth': async_frame_queue.qsize()
+    }
+    try:
+        slow_frame_queue.put_nowait((
+            time.time(), image_buffer, camera_id,
+            payload.get('results', []), payload.get('galleryVersion', gallery.version), capture
+        ))
+    except queue.Full:
+        with slow_frame_lock:
+            slow_frame_stats['dropped'] += 1
+
+def slow_frame_writer():
+    """Background writer: store queued slow frames and keep SLOW_FRAME_DIR under SLOW_FRAME_MAX_BYTES"""
+    os.makedirs(SLOW_FRAME_DIR, exist_ok=True)
+    
+    # Existing captures count towards the limit (oldest first by name)
+    captures = deque()
+    for name in sorted(os.listdir(SLOW_FRAME_DIR)):
+        path = os.path.join(SLOW_FRAME_DIR, name)
+        if os.path.isdir(path):
+            captures.append((path, sum(entry.stat().st_size for entry in os.scandir(path))))
+    disk_bytes = sum(size for _, size in captures)
+    
+    while True:
+        timestamp, image_buffer, camera_id, results, gallery_version, capture = slow_frame_queue.get()
+        capture_dir = os.path.join(
+            SLOW_FRAME_DIR,
+            f"{datetime.fromtimestamp(timestamp).strftime('%Y%m%d-%H%M%S-%f')}-{safe_path_component(capture['trace_id'])}"
+        )
+        try:
+            write_frame_dump(capture_dir, camera_id, [(timestamp, image_buffer, results)],
+                             gallery_version, extra={'capture': capture})
+            size = sum(entry.stat().st_size for entry in os.scandir(capture_dir))
+            captures.append((capture_dir, size))
+            disk_bytes += size
+            
+            while disk_bytes > SLOW_FRAME_MAX_BYTES and len(captures) > 1:
+                path, old_size = captures.popleft()
+                shutil.rmtree(path, ignore_errors=True)
+                disk_bytes -= old_size
+                with slow_frame_lock:
+                    slow_frame_stats['evicted'] += 1
+            
+            with slow_frame_lock:
+                slow_frame_stats['captured'] += 1
+            logger.warning(
+                f"[SlowFrame] {camera_id}: {capture['timings_ms']['total']:.0f} ms > "
+                f"{SLOW_FRAME_BUDGET_MS:.0f} ms budget, saved to {capture_dir}"
+            )
+        except OSError as e:
+            logger.error(f"[SlowFrame] Could not write {capture_dir}: {e}")
+        slow_frame_queue.task_done()
+
+def start_slow_frame_writer():
+    """Start the slow-frame writer thread (once)"""
+    global slow_frame_writer_started
+    
+    with slow_frame_lock:
+        if slow_frame_writer_started:
+            return
+        slow_frame_writer_started = True
+    
+    threading.Thread(target=slow_frame_writer, daemon=True).start()
+
+def replay_recording(dump_dir, output_path=None):
+    """
+    Feed a dumped recording back through process_video_frame, in order
+    
+    Replay is deterministic: frames run one at a time on a fresh visit
+    tracker clocked by the recorded timestamps, with the recorded camera
+    settings, offline (no Next.js verification, which would create meal
+    records, and no recording). If the dump includes gallery.npy it replaces
+    the gallery. The camera's settings and visit tracker are put back afterwards.
+    
+    Dumps usually start mid-visit, so visits the first frame reports as
+    'repeat' are opened before replaying. Recognition (each face's best
+    match and score) must reproduce exactly; consensus decisions can still
+    differ near the start, where evidence from before the dump is missing,
+    so they are reported separately.
+    
+    Writes one JSON line per frame (replayed and recorded results) to
+    output_path (default: <dump_dir>/replay.jsonl).
+    
+    Returns:
+        Summary dict (frames, mismatches = frames whose recognition differs,
+        decision_differences = frames whose faceId/decision differ)
+    """
+    global camera_config
+    
+    with open(os.path.join(dump_dir, 'manifest.json')) as f:
+        manifest = json.load(f)
+    camera_id = manifest['camera_id']
+    
+    gallery_path = os.path.join(dump_dir, 'gallery.npy')
+    if os.path.exists(gallery_path):
+        with open(os.path.join(dump_dir, 'gallery_ids.json')) as f:
+            face_ids = json.load(f)
+        publish_gallery(dict(zip(face_ids, np.load(gallery_path))), replace=True)
+    elif gallery.version != manifest.get('gallery_version'):
+        logger.warning(f"[Replay] Gallery differs from the recording (no gallery.npy in {dump_dir})")
+    
+    saved_config = camera_config
+    saved_tracker = visit_trackers.get(camera_id)
+    camera_config = dict(camera_config, **manifest.get('camera_config', {}))
+    tracker = VisitTracker()
+    if manifest['frames']:
+        first = manifest['frames'][0]
+        for result in first['results'] or []:
+            if result.get('decision') == 'repeat' and result.get('faceId'):
+                tracker.seed_visit(result['faceId'], result.get('confidence', 0.0), first['timestamp'])
+    with visit_trackers_lock:
+        visit_trackers[camera_id] = tracker
+    
+    def decisions(results):
+        return [(r.get('faceId'), r.get('decision')) for r in results]
+    
+    def recognition_matches(replayed, recorded):
+        if len(replayed) != len(recorded):
+            return False
+        for new, old in zip(replayed, recorded):
+            if 'candidateId' not in old:
+                # Recorded before candidates were kept: compare the committed identity
+                if old.get('decision') != 'pending' and new.get('decision') != 'pending' \
+                        and new.get('faceId') != old.get('faceId'):
+                    return False
+                continue
+            if new.get('candidateId') != old['candidateId'] or \
+                    abs(new.get('candidateScore', 0.0) - old.get('candidateScore', 0.0)) > REPLAY_SCORE_TOLERANCE:
+                return False
+        return True
+    
+    output_path = output_path or os.path.join(dump_dir, 'replay.jsonl')
+    mismatches = 0
+    decision_differences = 0
+    try:
+        with open(output_path, 'w') as out:
+            for frame in manifest['frames']:
+                with open(os.path.join(dump_dir, frame['file']), 'rb') as f:
+                    image_buffer = f.read()
+                
+                payload, status = process_video_frame(image_buffer, camera_id, frame['timestamp'], offline=True)
+                replayed = payload.get('results', [])
+                recorded = frame['results'] or []
+                
+                matches = recognition_matches(replayed, recorded)
+                decisions_match = decisions(replayed) == decisions(recorded)
+                mismatches += not matches
+                decision_differences += not decisions_match
+                
+                out.write(json.dumps({
+                    'file': frame['file'],
+                    'timestamp': frame['timestamp'],
+                    'status': status,
+                    'matches': matches,
+                    'decisions_match': decisions_match,
+                    'results': replayed,
+                    'recorded': recorded
+                }) + '\n')
+    finally:
+        camera_config = saved_config
+        with visit_trackers_lock:
+            if saved_tracker is None:
+                visit_trackers.pop(camera_id, None)
+            else:
+                visit_trackers[camera_id] = saved_tracker
+    
+    return {
+        'camera_id': camera_id,
+        'frames': len(manifest['frames']),
+        'mismatches': mismatches,
+        'decision_differences': decision_differences,
+        'output': output_path
+    }
+
+def detect_and_recognize_faces(image, snapshot=None, camera_id=DEFAULT_CAMERA_ID):
+    """
+    Detect and recognize faces in a decoded frame using InsightFace
+    
+    Args:
+        image: Decoded BGR frame (as returned by cv2.imdecode)
+        snapshot: GallerySnapshot to match against (defaults to the current one)
+        camera_id: Camera the frame came from (selects ROI and quality thresholds)
+        
+    Returns:
+        List of detected faces with recognition results
+        (bounding boxes are in full-frame coordinates). Faces that failed the
+        quality filter are included unrecognized, with their skipReason.
+    """
+    try:
+        # Crop to the ROI (boxes are mapped back via offset) and convert to RGB
+        rgb_image, offset = prepare_detection_input(image, camera_id)
+        
+        # Detect faces and extract embeddings for the ones good enough to recognize
+        faces, skipped = detect_quality_faces(rgb_image, camera_id)
+        
+        # Use one gallery snapshot for the whole frame (enrolls may publish
+        # new versions concurrently)
+        if snapshot is None:
+            snapshot = gallery
+        
+        # Per-frame messages are rate limited at INFO; LOG_LEVEL=DEBUG shows every one
+        faces_event = dict(FRAME_FACES_EVENT, camera=camera_id)
+        match_event = dict(FRAME_MATCH_EVENT, camera=camera_id)
+        detected = len(faces) + len(skipped)
+        if detected == 0:
+            logger.info("person not detected", extra=faces_event)
+            return []
+        
+        # Log detection count
+        skipped_note = ''
+        if skipped:
+            skipped_note = f" ({len(skipped)} low-quality, not recognized: {', '.join(reason for _, reason in skipped)})"
+        if detected == 1:
+            logger.info("person detected%s", skipped_note, extra=faces_event)
+        else:
+            logger.info("%d persons detected%s", detected, skipped_note, extra=faces_event)
+        
+        results = []
+        
+        for i, face in enumerate(faces):
+            # Get face embedding (512-dimensional vector)
+            embedding = face.embedding
+            
+            # Recognize face by comparing with known embeddings
+            face_id = None
+            confidence = 0.0
+            best_match_id = None
+            best_match_score = 0.0
+            
+            if len(snapshot) > 0:
+                # Cosine similarity with all known faces at once
+                with time_stage('gallery_search'):
+                    best_match_id, best_match_score = snapshot.best_match(embedding)
+                
+                # If similarity is above threshold, it's a match
+                if best_match_score > FACE_RECOGNITION_THRESHOLD:
+                    face_id = best_match_id
+                    confidence = float(best_match_score)
+                    if len(faces) == 1:
+                        logger.info("recognized (similarity: %.3f)", best_match_score, extra=match_event)
+                    else:
+                        logger.info("person %d: recognized (similarity: %.3f)", i + 1, best_match_score, extra=match_event)
+                else:
+                    if len(faces) == 1:
+                        logger.info("not recognized (similarity: %.3f, threshold: %s)",
+                                    best_match_score, FACE_RECOGNITION_THRESHOLD, extra=match_event)
+                    else:
+                        logger.info("person %d: not recognized (similarity: %.3f, threshold: %s)",
+                                    i + 1, best_match_score, FACE_RECOGNITION_THRESHOLD, extra=match_event)
+            else:
+                if len(faces) == 1:
+                    logger.info("not recognized", extra=match_event)
+                else:
+                    logger.info("person %d: not recognized", i + 1, extra=match_event)
+            
+            results.append({
+                'faceId': face_id,
+                'confidence': confidence,
+                'boundingBox': to_bounding_box(face.bbox, offset),  # Full-frame coordinates
+                'embedding': embedding.tolist(),  # Include for enrollment
+                'candidateId': best_match_id,  # Best match even below threshold (temporal consensus)
+                'candidateScore': best_match_score,
+                'skipReason': None
+            })
+        
+        # Low-quality faces are still reported as detected; only the
+        # embedding and gallery search were skipped for them
+        for face, reason in skipped:
+            results.append({
+                'faceId': None,
+                'confidence': 0.0,
+                'boundingBox': to_bounding_box(face.bbox, offset),
+                'embedding': None,
+                'candidateId': None,
+                'candidateScore': 0.0,
+                'skipReason': reason
+            })
+        
+        return results
         
     except Exception as e:
-        print(f"Error detecting faces: {e}")
+        logger.error(f"Error detecting faces: {e}")
         import traceback
         traceback.print_exc()
         return []
@@ -397,9 +1923,56 @@ def draw_detection_boxes_on_image(image, face_detections, recognition_results):
     
     return annotated_image
 
+def render_annotated_frame(image, faces, results):
+    """Draw the annotation overlay for one frame (returns a new image)"""
+    if not faces:
+        annotated_image = image.copy()
+        cv2.putText(
+            annotated_image,
+            "No faces detected",
+            (10, 30),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            1,
+            (0, 0, 255),
+            2
+        )
+        return annotated_image
+    return draw_detection_boxes_on_image(image, faces, results)
+
+def get_annotated_frame():
+    """
+    Annotated version of the latest frame, rendered only when a consumer asks
+    
+    Drawing happens at most once per frame no matter how many consumers
+    (window, /api/frames/annotated) ask for it.
+    
+    Returns:
+        (seq, annotated BGR image), or (seq, None) if no frame yet
+    """
+    global latest_annotated_image
+    
+    with annotation_lock:
+        with frame_lock:
+            seq = latest_frame_seq
+            render = latest_frame_render
+        
+        if render is None:
+            return seq, None
+        if latest_annotated_image[0] == seq:
+            return latest_annotated_image
+        
+        with time_stage('annotation'):
+            latest_annotated_image = (seq, render_annotated_frame(*render))
+        return latest_annotated_image
+
 def window_display_thread():
-    """Background thread to keep OpenCV window alive and update display"""
-    global window_initialized, window_thread_running, latest_annotated_image
+    """
+    Background thread to keep OpenCV window alive and update display
+    
+    Sleeps on the frame condition and only renders when a new frame is
+    published; window events are still pumped every WINDOW_EVENT_INTERVAL.
+    """
+    global window_initialized, window_thread_running
     
     if not SHOW_WINDOW:
         return
@@ -412,41 +1985,37 @@ def window_display_thread():
         cv2.resizeWindow(window_name, 640, 480)
         window_initialized = True
         
+        # Show blank window until the first frame
+        blank = np.zeros((480, 640, 3), dtype=np.uint8)
+        cv2.putText(blank, "Waiting for video feed...", (50, 240),
+                   cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+        cv2.imshow(window_name, blank)
+        
+        shown_seq = 0
         while window_thread_running:
             try:
-                with frame_lock:
-                    display_image = latest_annotated_image
-                
-                if display_image is not None:
-                    # Resize if image is too large for display
-                    height, width = display_image.shape[:2]
-                    max_width = 1280
-                    max_height = 720
-                    
-                    if width > max_width or height > max_height:
-                        scale = min(max_width / width, max_height / height)
-                        new_width = int(width * scale)
-                        new_height = int(height * scale)
-                        resized_image = cv2.resize(display_image, (new_width, new_height))
-                    else:
-                        resized_image = display_image.copy()
+                if wait_for_frame(shown_seq, WINDOW_EVENT_INTERVAL) is not None:
+                    shown_seq, display_image = get_annotated_frame()
                     
-                    # Display image
-                    cv2.imshow(window_name, resized_image)
-                else:
-                    # Show blank window if no frame yet
-                    blank = np.zeros((480, 640, 3), dtype=np.uint8)
-                    cv2.putText(blank, "Waiting for video feed...", (50, 240),
-                               cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-                    cv2.imshow(window_name, blank)
+                    if display_image is not None:
+                        # Resize if image is too large for display
+                        height, width = display_image.shape[:2]
+                        max_width = 1280
+                        max_height = 720
+                        
+                        if width > max_width or height > max_height:
+                            scale = min(max_width / width, max_height / height)
+                            new_width = int(width * scale)
+                            new_height = int(height * scale)
+                            display_image = cv2.resize(display_image, (new_width, new_height))
+                        
+                        # Display image
+                        cv2.imshow(window_name, display_image)
                 
                 # Process window events (must be called regularly)
                 key = cv2.waitKey(1) & 0xFF
                 if key == ord('q'):
                     break
-                    
-                # Small delay to prevent excessive CPU usage
-                threading.Event().wait(0.033)  # ~30 FPS
                 
             except cv2.error:
                 break
@@ -463,31 +2032,22 @@ def window_display_thread():
         window_initialized = False
         window_thread_running = False
 
-def show_image_in_window(image):
-    """Store annotated image for window display thread"""
-    global latest_annotated_image
-    
-    if not SHOW_WINDOW:
-        return
-    
-    # Store the annotated image for the display thread
-    with frame_lock:
-        latest_annotated_image = image.copy()
-
 def verify_user_with_nextjs(face_id):
     """Call Next.js API only for database verification"""
     if not USE_NEXTJS_VERIFICATION:
         return None
         
     try:
-        verify_response = requests.post(
-            f'{NEXTJS_API_URL}/api/hardware/verify',
-            json={
-                'method': 'FACE',
-                'faceId': face_id
-            },
-            timeout=5
-        )
+        with time_stage('verify'):
+            verify_response = requests.post(
+                f'{NEXTJS_API_URL}/api/hardware/verify',
+                json={
+                    'method': 'FACE',
+                    'faceId': face_id
+                },
+                headers=trace_headers(),
+                timeout=5
+            )
         
         if verify_response.status_code == 200:
             return verify_response.json()
@@ -500,15 +2060,133 @@ def verify_user_with_nextjs(face_id):
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
+    snapshot = gallery
     return jsonify({
         'status': 'ok',
         'service': 'Face Recognition Service (InsightFace)',
-        'known_faces': len(known_face_embeddings),
+        'known_faces': len(snapshot),
+        'gallery_version': snapshot.version,
         'nextjs_verification': USE_NEXTJS_VERIFICATION,
         'insightface_loaded': face_analyzer is not None,
+        'startup': startup_loader.status() if startup_loader else None,
+        'quality_filter': get_quality_stats(),
         'timestamp': datetime.now().isoformat()
     })
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    """
+    Readiness probe: 200 once the models are warm and the gallery is loaded,
+    503 while the service is still starting (or startup failed)
+    
+    /health answers as soon as the port is bound; route traffic on /ready.
+    """
+    if startup_loader is not None:
+        status = startup_loader.status()
+    else:
+        # Models loaded in-process without the background loader (e.g. benchmark.py)
+        status = {'state': 'ready' if face_analyzer is not None else 'pending',
+                  'ready': face_analyzer is not None, 'error': None}
+    return jsonify(status), 200 if status['ready'] else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics: stage latency histograms, frame counters, queue depth, gallery size, CPU time"""
+    lines = [
+        '# HELP face_service_stage_duration_seconds Time spent in each pipeline stage',
+        '# TYPE face_service_stage_duration_seconds histogram'
+    ]
+    for stage, histogram in stage_histograms.items():
+        lines.extend(histogram.render('face_service_stage_duration_seconds', f'stage="{stage}"'))
+    
+    with frame_counters_lock:
+        counters = {camera_id: dict(c) for camera_id, c in frame_counters.items()}
+    for outcome in ('received', 'processed', 'dropped'):
+        lines.append(f'# HELP face_service_frames_{outcome}_total Frames {outcome} per camera')
+        lines.append(f'# TYPE face_service_frames_{outcome}_total counter')
+        for camera_id, camera_counters in counters.items():
+            lines.append(f'face_service_frames_{outcome}_total{{camera="{prometheus_label(camera_id)}"}} {camera_counters[outcome]}')
+    
+    quality = get_quality_stats()
+    lines.append('# HELP face_service_faces_skipped_total Faces dropped by the quality filter')
+    lines.append('# TYPE face_service_faces_skipped_total counter')
+    for camera_id, stats in quality['cameras'].items():
+        for reason, count in stats['skipped_by_reason'].items():
+            lines.append(f'face_service_faces_skipped_total{{camera="{prometheus_label(camera_id)}",reason="{reason}"}} {count}')
+    
+    snapshot = gallery
+    lines.extend([
+        '# HELP face_service_inference_queue_depth Frames waiting for an async worker',
+        '# TYPE face_service_inference_queue_depth gauge',
+        f'face_service_inference_queue_depth {async_frame_queue.qsize()}',
+        '# HELP face_service_gallery_size Known faces in the current gallery',
+        '# TYPE face_service_gallery_size gauge',
+        f'face_service_gallery_size {len(snapshot)}',
+        '# HELP face_service_gallery_version Version of the current gallery snapshot',
+        '# TYPE face_service_gallery_version gauge',
+        f'face_service_gallery_version {snapshot.version}',
+        '# HELP face_service_slow_frames_total Frames over SLOW_FRAME_BUDGET_MS, by what happened to the capture',
+        '# TYPE face_service_slow_frames_total counter',
+        *(f'face_service_slow_frames_total{{outcome="{outcome}"}} {count}'
+          for outcome, count in slow_frame_stats.items()),
+        '# HELP face_service_recorders Cameras with a flight recorder',
+        '# TYPE face_service_recorders gauge',
+        f'face_service_recorders {len(frame_recorders)}',
+        '# HELP face_service_recorder_bytes Bytes allocated by flight recorders',
+        '# TYPE face_service_recorder_bytes gauge',
+        f'face_service_recorder_bytes {sum(len(r.data) for r in list(frame_recorders.values()))}',
+        '# HELP face_service_recorders_total Recorders refused at RECORD_MAX_CAMERAS or expired when idle',
+        '# TYPE face_service_recorders_total counter',
+        *(f'face_service_recorders_total{{outcome="{outcome}"}} {count}'
+          for outcome, count in recorder_stats.items()),
+        '# HELP process_cpu_seconds_total User and system CPU time of the service process',
+        '# TYPE process_cpu_seconds_total counter',
+        f'process_cpu_seconds_total {time.process_time():.3f}'
+    ])
+    
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/profile', methods=['GET'])
+def profile():
+    """
+    Sample all request threads for a while and return where the time went
+    
+    Disabled unless PROFILER_ENABLED=true. Callers must be local, or send
+    X-Admin-Token matching PROFILER_TOKEN.
+    
+    Query:
+        seconds: Profile length (default 10, max PROFILER_MAX_SECONDS)
+        hz: Samples per second (default 100, max PROFILER_MAX_HZ)
+        idle=1: Also count threads waiting on locks, queues and sockets
+        
+    Returns:
+        Collapsed stacks ("thread;outer;...;inner count" per line), ready for
+        flamegraph.pl or speedscope. 409 while another profile is running.
+    """
+    if not PROFILER_ENABLED:
+        return jsonify({'error': 'Profiler disabled (set PROFILER_ENABLED=true)'}), 404
+    if not is_local_request() and not (PROFILER_TOKEN and request.headers.get('X-Admin-Token') == PROFILER_TOKEN):
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    seconds = min(max(request.args.get('seconds', 10, type=float), 0.1), PROFILER_MAX_SECONDS)
+    hz = min(max(request.args.get('hz', 100, type=float), 1), PROFILER_MAX_HZ)
+    include_idle = request.args.get('idle') == '1'
+    
+    if not profiler_lock.acquire(blocking=False):
+        return jsonify({'error': 'A profile is already running'}), 409
+    try:
+        logger.info(f"[Profile] Sampling for {seconds:g}s at {hz:g} Hz")
+        counts, rounds = sample_stacks(seconds, hz, include_idle)
+    finally:
+        profiler_lock.release()
+    
+    body = ''.join(f"{stack} {count}\n" for stack, count in counts.most_common())
+    return Response(body, mimetype='text/plain', headers={
+        'X-Profile-Samples': str(sum(counts.values())),
+        'X-Profile-Rounds': str(rounds),
+        'Content-Disposition': 'inline; filename="profile.collapsed"'
+    })
+
 @app.route('/api/hardware/person-detected', methods=['POST'])
 def person_detected():
     """ESP32 notifies when person is detected by PIR sensor"""
@@ -524,73 +2202,115 @@ def person_detected():
             'timestamp': datetime.now().isoformat()
         })
     except Exception as e:
-        print(f"[Error] /api/hardware/person-detected: {e}")
+        logger.error(f"[Error] /api/hardware/person-detected: {e}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/hardware/video-stream', methods=['POST'])
-def video_stream():
+def publish_latest_frame(image_buffer, results, image=None, faces=()):
+    """
+    Make a processed frame and its results the latest one and wake up viewer streams
+    
+    Args:
+        image_buffer: JPEG bytes of the frame
+        results: Per-face results sent to viewers
+        image: Decoded frame, kept (not copied) so the annotation can be drawn on demand
+        faces: Detected faces to draw on the annotation
+    """
+    global latest_frame_buffer, latest_detection_results, latest_frame_seq, latest_frame_time
+    global latest_frame_render
+    
+    with frame_condition:
+        latest_frame_buffer = image_buffer
+        latest_detection_results = list(results)
+        latest_frame_render = (image, list(faces), latest_detection_results) if image is not None else None
+        latest_frame_seq += 1
+        latest_frame_time = datetime.now()
+        frame_condition.notify_all()
+
+def wait_for_frame(after_seq, timeout):
+    """
+    Block until a frame newer than after_seq is published
+    
+    Returns:
+        (seq, jpeg_bytes, detections), or None on timeout
+    """
+    with frame_condition:
+        if not frame_condition.wait_for(lambda: latest_frame_seq > after_seq, timeout):
+            return None
+        return latest_frame_seq, latest_frame_buffer, latest_detection_results
+
+def process_video_frame(image_buffer, camera_id=DEFAULT_CAMERA_ID, frame_time=None, offline=False):
     """
-    Main endpoint for ESP32 to send video frames
+    Run one camera frame through the whole pipeline
     Python does everything:
     1. Receives video frame (JPEG image)
     2. Detects faces using InsightFace
     3. Recognizes persons
     4. Verifies with Next.js (optional - only for database check)
+    
+    Shared by the HTTP endpoint and the persistent stream ingest.
+    
+    Args:
+        image_buffer: JPEG image bytes
+        camera_id: Camera the frame came from
+        frame_time: Capture time (epoch seconds) driving the visit clock;
+                    replay passes recorded times, live frames use now
+        offline: Replay - no Next.js verification (it creates meal records)
+                 and the frame isn't kept in the flight recorder
+        
+    Returns:
+        (response dict, HTTP status code)
     """
     try:
-        if face_analyzer is None:
-            return jsonify({
-                'error': 'Face recognition model not initialized'
-            }), 500
-        
-        # Get image from request
-        image_buffer = request.data
+        if not service_ready():
+            count_frame(camera_id, 'dropped')
+            return {
+                'error': 'Face recognition service is still starting'
+            }, 503
         
         if not image_buffer:
-            return jsonify({'error': 'No image data provided'}), 400
+            count_frame(camera_id, 'dropped')
+            return {'error': 'No image data provided'}, 400
         
-        # Decode image to verify it's valid
-        nparr = np.frombuffer(image_buffer, np.uint8)
-        display_image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        # Decode image once - used for validation, detection and display
+        with time_stage('decode'):
+            display_image = decode_frame(image_buffer)
         
         if display_image is None:
-            return jsonify({'error': 'Failed to decode image'}), 400
-        
-        # Store latest frame for video viewer
-        with frame_lock:
-            global latest_frame_buffer, latest_detection_results
-            latest_frame_buffer = image_buffer
+            count_frame(camera_id, 'dropped')
+            return {'error': 'Failed to decode image'}, 400
         
-        # Detect and recognize faces
-        faces = detect_and_recognize_faces(image_buffer)
+        # Detect and recognize faces against a single gallery version
+        snapshot = gallery
+        faces = detect_and_recognize_faces(display_image, snapshot, camera_id)
         
         if len(faces) == 0:
-            # Still show image even if no faces
-            if SHOW_WINDOW and display_image is not None:
-                cv2.putText(
-                    display_image,
-                    "No faces detected",
-                    (10, 30),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    1,
-                    (0, 0, 255),
-                    2
-                )
-                show_image_in_window(display_image)
+            # Store latest frame for video viewer (window still shows it, annotated lazily)
+            publish_latest_frame(image_buffer, [], display_image)
+            if not offline:
+                record_frame(camera_id, image_buffer, [], frame_time)
             
-            return jsonify({
+            count_frame(camera_id, 'processed')
+            return {
                 'success': True,
                 'message': 'Frame received - no faces detected',
                 'faces_detected': 0,
                 'faces_recognized': 0,
+                'galleryVersion': snapshot.version,
                 'timestamp': datetime.now().isoformat()
-            })
+            }, 200
         
         # Process each detected face
+        consensus_settings = get_consensus_settings(camera_id)
+        use_verification = USE_NEXTJS_VERIFICATION and not offline
+        tracker = get_visit_tracker(camera_id) if consensus_settings['enabled'] else None
+        
         results = []
         for face in faces:
             face_id = face.get('faceId')
             confidence = face.get('confidence', 0.0)
+            candidate_id = face.pop('candidateId', None)
+            candidate_score = face.pop('candidateScore', 0.0)
+            skip_reason = face.get('skipReason')
             
             # Remove embedding from response (too large)
             face.pop('embedding', None)
@@ -601,72 +2321,664 @@ def video_stream():
             is_eligible = False
             user_info = {}
             reason = ''
+            decision = None
+            needs_verification = face_id and confidence > FACE_RECOGNITION_THRESHOLD
+            if skip_reason:
+                reason = f'Face quality too low ({skip_reason})'
+            
+            if tracker and candidate_id:
+                # A visit is verified once (the verify call creates a meal
+                # record); later frames reuse its result, failed calls are retried
+                decision, visit = tracker.observe(candidate_id, candidate_score, consensus_settings, frame_time)
+                needs_verification = False
+                
+                if decision == 'pending':
+                    reason = 'Confirming identity'
+                else:
+                    face_id = visit['faceId']
+                    confidence = visit['confidence']
+                    face['faceId'] = face_id
+                    face['confidence'] = confidence
+                    
+                    if decision == 'committed':
+                        logger.info(f"[Visit] {camera_id}: {face_id} confirmed over {visit['frames']} frame(s) (similarity: {confidence:.3f})",
+                                    extra={'event': 'visit_committed', 'camera': camera_id})
+                    
+                    if not use_verification:
+                        reason = 'Verification unavailable'
+                    elif tracker.begin_verification(visit, frame_time, consensus_settings):
+                        verification_result = verify_user_with_nextjs(face_id)
+                        tracker.finish_verification(visit, verification_result)
+                        if not verification_result:
+                            reason = 'Verification unavailable'
+                    elif visit['verification_done']:
+                        verification_result = visit['verification']
+                    elif visit['verifying']:
+                        reason = 'Verifying'
+                    else:
+                        reason = 'Verification unavailable'
             
-            if face_id and confidence > FACE_RECOGNITION_THRESHOLD:
+            if needs_verification:
                 # Verify user with Next.js to check eligibility
-                if USE_NEXTJS_VERIFICATION:
+                if use_verification:
                     verification_result = verify_user_with_nextjs(face_id)
                 
-                if verification_result:
-                    user_info = verification_result.get('user', {})
-                    is_verified = verification_result.get('verified', False)
-                    is_eligible = verification_result.get('eligible', False)
-                    reason = verification_result.get('reason', '')
-                else:
-                    # Face recognized but verification failed
-                    is_verified = False
-                    is_eligible = False
+                if not verification_result:
                     reason = 'Verification unavailable'
             
+            if verification_result:
+                user_info = verification_result.get('user', {})
+                is_verified = verification_result.get('verified', False)
+                is_eligible = verification_result.get('eligible', False)
+                reason = verification_result.get('reason', '')
+            
             results.append({
                 'faceId': face_id,
                 'confidence': confidence,
+                'boundingBox': face.get('boundingBox'),
+                'decision': decision,
+                'candidateId': candidate_id,  # Best gallery match whatever its score (lets replay compare recognition)
+                'candidateScore': float(candidate_score),
                 'verified': is_verified,
                 'eligible': is_eligible,
                 'user': user_info,
-                'message': reason
+                'message': reason,
+                'skipReason': skip_reason
             })
         
-        # Store latest detection results
-        with frame_lock:
-            latest_detection_results = results.copy()
-        
-        # Draw detection boxes and display in window
-        if SHOW_WINDOW and display_image is not None:
-            display_image = draw_detection_boxes_on_image(display_image, faces, results)
-            show_image_in_window(display_image)
+        # Store latest frame and its detection results for video viewers and the window;
+        # boxes are only drawn if someone looks at the annotated frame
+        publish_latest_frame(image_buffer, results, display_image, faces)
+        if not offline:
+            record_frame(camera_id, image_buffer, results, frame_time)
         
         # Return response to ESP32
-        return jsonify({
+        count_frame(camera_id, 'processed')
+        return {
             'success': True,
             'message': 'Frame processed successfully',
             'faces_detected': len(faces),
             'faces_recognized': len([r for r in results if r.get('faceId')]),
             'results': results,
+            'galleryVersion': snapshot.version,
             'timestamp': datetime.now().isoformat()
-        })
+        }, 200
         
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return jsonify({'error': str(e)}), 500
+        count_frame(camera_id, 'dropped')
+        return {'error': str(e)}, 500
 
-@app.route('/enroll', methods=['POST'])
-def enroll_face():
-    """
-    Enroll a new face for recognition
-    
-    Request:
-        - Content-Type: application/json
-        - Body: {
-            "userId": "user-id",
+# Asynchronous submission state
+async_frame_queue = queue.Queue(maxsize=ASYNC_QUEUE_SIZE)
+async_results = OrderedDict()  # frame_id -> job dict (queued, then done)
+async_results_lock = threading.Lock()
+async_workers_started = False
+
+def async_frame_worker():
+    """Background worker: process queued frames and publish their results"""
+    while True:
+        frame_id, image_buffer, camera_id, callback_url, trace_id = async_frame_queue.get()
+        with trace_request(trace_id) as trace:
+            try:
+                payload, status = process_video_frame(image_buffer, camera_id)
+            except Exception as e:
+                payload, status = {'error': str(e)}, 500
+            capture_slow_frame(image_buffer, camera_id, payload, status, trace)
+        
+        payload['frameId'] = frame_id
+        payload['traceId'] = trace.trace_id
+        payload['timings'] = trace.timings_ms()
+        with async_results_lock:
+            job = async_results.get(frame_id)
+            if job is not None:
+                job.update(state='done', payload=payload, status=status)
+        
+        if callback_url:
+            try:
+                requests.post(callback_url, json=payload, timeout=5, allow_redirects=False)
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"[Async] Callback to {callback_url} failed: {e}")
+        
+        async_frame_queue.task_done()
+
+def start_async_workers():
+    """Start the async frame workers (once)"""
+    global async_workers_started
+    
+    with async_results_lock:
+        if async_workers_started:
+            return
+        async_workers_started = True
+    
+    for _ in range(ASYNC_WORKERS):
+        threading.Thread(target=async_frame_worker, daemon=True).start()
+
+def callback_url_allowed(url):
+    """
+    True if url is under one of ASYNC_CALLBACK_BASE_URLS
+    
+    Compared by parsed scheme, host and port (plus path prefix), so
+    callers can't make the service send requests to arbitrary hosts.
+    """
+    try:
+        target = urlsplit(url)
+        target_port = target.port
+    except ValueError:
+        return False
+    if target.scheme not in ('http', 'https') or target.username or target.password:
+        return False
+    
+    for base_url in ASYNC_CALLBACK_BASE_URLS:
+        base = urlsplit(base_url)
+        base_path = base.path.rstrip('/')
+        if (target.scheme == base.scheme and target.hostname == base.hostname
+                and target_port == base.port
+                and (target.path == base_path or target.path.startswith(base_path + '/'))):
+            return True
+    return False
+
+def submit_frame_async(image_buffer, camera_id, callback_url=None, trace_id=None):
+    """
+    Queue a frame for background processing (trace_id follows it to the worker)
+    
+    Returns:
+        frame_id, or None if the queue is full
+    """
+    start_async_workers()
+    
+    frame_id = uuid.uuid4().hex
+    with async_results_lock:
+        async_results[frame_id] = {
+            'state': 'queued',
+            'cameraId': camera_id,
+            'submitted_at': time.time()
+        }
+        while len(async_results) > ASYNC_RESULT_CAPACITY:
+            async_results.popitem(last=False)
+    
+    try:
+        async_frame_queue.put_nowait((frame_id, image_buffer, camera_id, callback_url, trace_id))
+    except queue.Full:
+        with async_results_lock:
+            async_results.pop(frame_id, None)
+        return None
+    
+    return frame_id
+
+def wants_async_submission():
+    """True if the client asked for 202 + later result instead of waiting"""
+    if request.args.get('async') in ('1', 'true'):
+        return True
+    return 'respond-async' in request.headers.get('Prefer', '')
+
+@app.route('/api/hardware/video-stream', methods=['POST'])
+def video_stream():
+    """
+    Main endpoint for ESP32 to send video frames (one JPEG per POST)
+    
+    Cameras that keep a connection open should use the stream ingest
+    on INGEST_PORT instead; this endpoint remains as the fallback.
+    
+    Microcontrollers can send "Accept: application/x-face-result" (or
+    ?format=binary) to get the small binary struct from pack_frame_result()
+    instead of JSON.
+    
+    With "Prefer: respond-async" (or ?async=1) the frame is only validated and
+    queued; the response is 202 with a frameId, and the result is fetched from
+    /api/hardware/frames/<frameId> or POSTed to the X-Callback-URL header.
+    
+    Every response carries X-Trace-Id (the caller's, if it sent one) and a
+    Server-Timing header with per-stage durations; the trace id is also
+    forwarded to the Next.js verify call.
+    """
+    with trace_request(incoming_trace_id()) as trace:
+        if wants_async_submission():
+            response, status = submit_video_frame_async(trace)
+        else:
+            camera_id = get_camera_id()
+            count_frame(camera_id, 'received')
+            payload, status = process_video_frame(request.data, camera_id)
+            
+            if wants_binary_result():
+                response = Response(pack_frame_result(payload, status), mimetype=BINARY_RESULT_MIMETYPE)
+            else:
+                payload['traceId'] = trace.trace_id
+                response = jsonify(payload)
+            capture_slow_frame(request.data, camera_id, payload, status, trace)
+        
+        response.status_code = status
+        return with_trace_headers(response, trace)
+
+def submit_video_frame_async(trace):
+    """Validate and queue the request's frame (video_stream async mode)"""
+    image_buffer = request.data
+    if not image_buffer:
+        return jsonify({'error': 'No image data provided'}), 400
+    
+    # Cheap validity check (JPEG start-of-image marker); full decode happens in the worker
+    if image_buffer[:2] != b'\xff\xd8':
+        return jsonify({'error': 'Frame is not a JPEG image'}), 400
+    
+    callback_url = request.headers.get('X-Callback-URL')
+    if callback_url and not callback_url_allowed(callback_url):
+        return jsonify({'error': 'X-Callback-URL is not under an allowed base URL (ASYNC_CALLBACK_BASE_URLS)'}), 400
+    
+    camera_id = get_camera_id()
+    count_frame(camera_id, 'received')
+    frame_id = submit_frame_async(image_buffer, camera_id, callback_url, trace.trace_id)
+    if frame_id is None:
+        count_frame(camera_id, 'dropped')
+        response = jsonify({'error': 'Frame queue full'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    
+    return jsonify({
+        'success': True,
+        'frameId': frame_id,
+        'traceId': trace.trace_id,
+        'resultUrl': f'/api/hardware/frames/{frame_id}'
+    }), 202
+
+def compact_frame_result(payload, status):
+    """
+    Reduce a process_video_frame() response to what a camera needs
+    
+    Keys: s = status code, n = faces detected, r = results with
+    id (faceId), d (decision), v (verified), e (eligible), nm (display name)
+    """
+    if status != 200:
+        return {'s': status, 'err': payload.get('error', '')}
+    
+    return {
+        's': status,
+        'n': payload.get('faces_detected', 0),
+        'r': [
+            {
+                'id': result.get('faceId'),
+                'd': result.get('decision'),
+                'v': int(bool(result.get('verified'))),
+                'e': int(bool(result.get('eligible'))),
+                'nm': (result.get('user') or {}).get('name', '')
+            }
+            for result in payload.get('results', [])
+        ]
+    }
+
+def pack_frame_result(payload, status):
+    """
+    Pack a process_video_frame() response into a small fixed-layout binary struct
+    
+    Layout (little-endian, so the ESP32 can read fields in place):
+        header, 5 bytes:  uint8 version, uint16 status, uint8 faces detected,
+                          uint8 record count
+        record, 24 bytes: uint8 decision (0 none, 1 pending, 2 committed, 3 repeat),
+                          uint8 flags (bit0 recognized, bit1 verified, bit2 eligible),
+                          uint8 confidence (percent),
+                          char[21] display name (UTF-8, NUL-padded, always NUL-terminated)
+    """
+    results = payload.get('results', [])[:BINARY_RESULT_MAX_RECORDS] if status == 200 else []
+    
+    data = bytearray(BINARY_RESULT_HEADER.pack(
+        BINARY_RESULT_VERSION,
+        status,
+        min(payload.get('faces_detected', 0), 255),
+        len(results)
+    ))
+    
+    for result in results:
+        flags = 0
+        if result.get('faceId'):
+            flags |= 1
+        if result.get('verified'):
+            flags |= 2
+        if result.get('eligible'):
+            flags |= 4
+        
+        # Truncate on a character boundary so the device never sees half a UTF-8 sequence
+        name = (result.get('user') or {}).get('name', '')
+        name_bytes = name.encode('utf-8')[:20].decode('utf-8', 'ignore').encode('utf-8')
+        
+        data += BINARY_RESULT_RECORD.pack(
+            BINARY_DECISION_CODES.get(result.get('decision'), 0),
+            flags,
+            max(0, min(100, int(round(result.get('confidence', 0.0) * 100)))),
+            name_bytes
+        )
+    
+    return bytes(data)
+
+def wants_binary_result():
+    """True if the HTTP client negotiated the binary result format"""
+    if request.args.get('format') == 'binary':
+        return True
+    return request.accept_mimetypes.best_match(
+        ['application/json', BINARY_RESULT_MIMETYPE]
+    ) == BINARY_RESULT_MIMETYPE
+
+class FrameStreamHandler(socketserver.StreamRequestHandler):
+    """
+    Persistent frame ingest for one camera connection
+    
+    Protocol (all lengths are 4-byte big-endian unsigned integers):
+        camera -> "HELLO <camera-id> [json|binary]\n"   once, after connecting
+        camera -> <length><JPEG bytes>                  per frame (length 0 = goodbye)
+        server -> <length><result>                      per frame, in order
+    
+    Results are compact JSON by default, or pack_frame_result() structs
+    when the camera asks for binary.
+    """
+    
+    timeout = STREAM_IDLE_TIMEOUT
+    
+    def handle(self):
+        hello = self.rfile.readline(256).decode('utf-8', 'replace').split()
+        if not hello or hello[0] != 'HELLO':
+            return
+        camera_id = tracked_camera_id(hello[1] if len(hello) > 1 else DEFAULT_CAMERA_ID)
+        self.binary = len(hello) > 2 and hello[2] == 'binary'
+        
+        # Results are small; send them immediately instead of waiting for Nagle
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        logger.info(f"[Stream] {camera_id} connected from {self.client_address[0]}", extra={'camera': camera_id})
+        
+        frames = 0
+        try:
+            while True:
+                header = self.rfile.read(4)
+                if len(header) < 4:
+                    break
+                
+                (length,) = struct.unpack('!I', header)
+                if length == 0:
+                    break
+                
+                if length > MAX_STREAM_FRAME_BYTES:
+                    self.send_result({'error': 'Frame too large'}, 413)
+                    break
+                
+                image_buffer = self.rfile.read(length)
+                if len(image_buffer) < length:
+                    break
+                
+                count_frame(camera_id, 'received')
+                with trace_request() as trace:
+                    payload, status = process_video_frame(image_buffer, camera_id)
+                    capture_slow_frame(image_buffer, camera_id, payload, status, trace)
+                self.send_result(payload, status)
+                frames += 1
+        except OSError:
+            # Timeout or connection reset - the camera will reconnect
+            pass
+        
+        logger.info(f"[Stream] {camera_id} disconnected after {frames} frame(s)", extra={'camera': camera_id})
+    
+    def send_result(self, payload, status):
+        if self.binary:
+            data = pack_frame_result(payload, status)
+        else:
+            message = compact_frame_result(payload, status)
+            data = json.dumps(message, separators=(',', ':')).encode('utf-8')
+        self.wfile.write(struct.pack('!I', len(data)) + data)
+
+class FrameStreamServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def start_stream_ingest():
+    """Start the persistent stream ingest server in a background thread"""
+    if INGEST_PORT == 0:
+        return None
+    
+    try:
+        server = FrameStreamServer(('0.0.0.0', INGEST_PORT), FrameStreamHandler)
+    except OSError as e:
+        logger.warning(f"Stream ingest disabled: cannot listen on port {INGEST_PORT} ({e})")
+        return None
+    
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Stream ingest listening on port {INGEST_PORT}")
+    return server
+
+@app.route('/api/hardware/frames/<frame_id>', methods=['GET'])
+def async_frame_result(frame_id):
+    """
+    Result of a frame submitted with Prefer: respond-async
+    
+    Returns 202 while the frame is still queued, the normal video-stream
+    response (JSON or binary, as negotiated) once it is done, and 404 for
+    unknown or expired frame IDs.
+    """
+    with async_results_lock:
+        job = async_results.get(frame_id)
+        job = dict(job) if job else None
+    
+    if job is None:
+        return jsonify({'error': 'Unknown or expired frameId'}), 404
+    
+    if job['state'] != 'done':
+        return jsonify({
+            'frameId': frame_id,
+            'state': job['state'],
+            'queueDepth': async_frame_queue.qsize()
+        }), 202
+    
+    if wants_binary_result():
+        return Response(pack_frame_result(job['payload'], job['status']), status=job['status'], mimetype=BINARY_RESULT_MIMETYPE)
+    return jsonify(job['payload']), job['status']
+
+@app.route('/detect', methods=['POST'])
+def detect():
+    """
+    Detect (and optionally recognize) faces in a single JPEG frame
+    
+    Request:
+        - Content-Type: image/jpeg (raw bytes)
+        - ?mode=detect (default): boxes only - skips the recognition model
+          and the gallery, for presence counting / PIR confirmation
+        - ?mode=recognize: also match faces against the gallery
+    
+    Response:
+        {"faces": [{"faceId", "confidence", "boundingBox", "skipReason"}], ...}
+        (detect mode returns {"boundingBox", "score", "skipReason"} per face)
+    
+    Both modes report every detected face. Faces that fail the camera's
+    quality filter carry skipReason; recognize mode leaves them unmatched
+    (faceId null), as it does faces that aren't in the gallery.
+    
+    No Next.js verification or visit tracking happens here.
+    """
+    try:
+        if not service_ready():
+            return jsonify({'error': 'Face recognition service is still starting'}), 503
+        
+        mode = request.args.get('mode', 'detect')
+        if mode not in ('detect', 'recognize'):
+            return jsonify({'error': "mode must be 'detect' or 'recognize'"}), 400
+        
+        if not request.data:
+            return jsonify({'error': 'No image data provided'}), 400
+        
+        with time_stage('decode'):
+            image = decode_frame(request.data)
+        if image is None:
+            return jsonify({'error': 'Failed to decode image'}), 400
+        
+        camera_id = get_camera_id()
+        
+        if mode == 'detect':
+            return jsonify({
+                'mode': mode,
+                'faces': detect_faces_only(image, camera_id)
+            })
+        
+        snapshot = gallery
+        faces = [
+            {
+                'faceId': face['faceId'],
+                'confidence': face['confidence'],
+                'boundingBox': face['boundingBox'],
+                'skipReason': face['skipReason']
+            }
+            for face in detect_and_recognize_faces(image, snapshot, camera_id)
+        ]
+        
+        return jsonify({
+            'mode': mode,
+            'faces': faces,
+            'galleryVersion': snapshot.version
+        })
+    except Exception as e:
+        logger.error(f"[Error] /detect: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/analyze', methods=['POST'])
+def analyze():
+    """
+    Full InsightFace analysis of one image for the local detection scripts
+    
+    Lets detect_face.py & co. reuse the warm model instead of loading their
+    own (see face_models.ServiceFaceAnalyzer). Only callers on this machine
+    are served, since the response contains raw embeddings.
+    
+    Request:
+        - Body: encoded image (JPEG or PNG), analyzed as a whole (no ROI)
+    
+    Response:
+        {"width", "height", "faces": [{"bbox": [x1, y1, x2, y2], "score",
+                                       "kps": [[x, y] x5], "embedding": [512 floats]}]}
+    """
+    if not is_local_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    try:
+        if face_analyzer is None:
+            return jsonify({'error': 'Face recognition model not initialized'}), 503
+        
+        if not request.data:
+            return jsonify({'error': 'No image data provided'}), 400
+        
+        image = decode_frame(request.data)
+        if image is None:
+            return jsonify({'error': 'Failed to decode image'}), 400
+        
+        faces = face_analyzer.get(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+        return jsonify({
+            'width': image.shape[1],
+            'height': image.shape[0],
+            'faces': [
+                {
+                    'bbox': face.bbox.tolist(),
+                    'score': float(face.det_score),
+                    'kps': face.kps.tolist() if face.kps is not None else None,
+                    'embedding': face.embedding.tolist() if face.embedding is not None else None
+                }
+                for face in faces
+            ]
+        })
+    except Exception as e:
+        logger.error(f"[Error] /analyze: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/cameras/<camera_id>/roi', methods=['GET', 'PUT', 'DELETE'])
+def camera_roi(camera_id):
+    """
+    Get, set or clear a camera's region of interest
+    
+    PUT body:
+        {"x": 80, "y": 40, "width": 480, "height": 400}  # frame pixels
+    
+    Changes apply to the next frame and are not written back to cameras.json.
+    DELETE falls back to the "default" camera's ROI (full frame if it has none).
+    """
+    try:
+        if request.method == 'PUT':
+            data = request.get_json(silent=True)
+            if not isinstance(data, dict):
+                return jsonify({'error': 'JSON body required'}), 400
+            try:
+                roi = parse_roi(data)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            if tracked_camera_id(camera_id) != camera_id:
+                return jsonify({'error': f'More than MAX_CAMERAS ({MAX_CAMERAS}) cameras'}), 400
+            set_camera_roi(camera_id, roi)
+        elif request.method == 'DELETE':
+            set_camera_roi(camera_id, None)
+        
+        return jsonify({
+            'success': True,
+            'cameraId': camera_id,
+            'roi': get_camera_roi_setting(camera_id)
+        })
+    except Exception as e:
+        logger.error(f"[Error] /api/cameras/{camera_id}/roi: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/cameras/<camera_id>/recording', methods=['GET'])
+def camera_recording(camera_id):
+    """Status of a camera's flight recorder (frames held, seconds covered)"""
+    recorder = frame_recorders.get(camera_id)
+    return jsonify({
+        'cameraId': camera_id,
+        'enabled': RECORD_SECONDS > 0,
+        'recording': recorder.stats() if recorder else None
+    })
+
+@app.route('/api/cameras/<camera_id>/recording/dump', methods=['POST'])
+def dump_camera_recording(camera_id):
+    """
+    Write the last seconds of a camera's frames to disk (see dump_recording)
+    
+    Query:
+        seconds: How far back to go (default RECORD_SECONDS)
+        gallery=1: Also dump the current gallery so replay matches exactly
+    
+    Replay with: python face_recognition_insightface.py --replay <path>
+    """
+    try:
+        dump_dir, frame_count = dump_recording(
+            camera_id,
+            seconds=request.args.get('seconds', type=float),
+            include_gallery=request.args.get('gallery') == '1'
+        )
+        if dump_dir is None:
+            return jsonify({'error': f'No recorded frames for camera {camera_id}'}), 404
+        
+        logger.info(f"[Recording] Dumped {frame_count} frame(s) of {camera_id} to {dump_dir}")
+        return jsonify({
+            'success': True,
+            'cameraId': camera_id,
+            'frames': frame_count,
+            'path': dump_dir
+        })
+    except Exception as e:
+        logger.error(f"[Error] /api/cameras/{camera_id}/recording/dump: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/enroll', methods=['POST'])
+def enroll_face():
+    """Enroll endpoint wrapper that adds X-Trace-Id and Server-Timing headers"""
+    with trace_request(incoming_trace_id()) as trace:
+        response = make_response(enroll_face_traced())
+        return with_trace_headers(response, trace)
+
+def enroll_face_traced():
+    """
+    Enroll a new face for recognition
+    
+    Request:
+        - Content-Type: application/json
+        - Body: {
+            "userId": "user-id",
             "faceId": "face-id-to-store-in-db",
             "image": "base64-encoded-jpeg-image"
           }
     """
     try:
-        if face_analyzer is None:
-            return jsonify({'error': 'Face recognition model not initialized'}), 500
+        if not service_ready():
+            return jsonify({'error': 'Face recognition service is still starting'}), 503
         
         data = request.json
         user_id = data.get('userId')
@@ -677,15 +2989,18 @@ def enroll_face():
             return jsonify({'error': 'userId and image required'}), 400
         
         # Decode base64 image
-        import base64
-        image_buffer = base64.b64decode(image_base64)
+        with time_stage('decode'):
+            image_buffer = base64.b64decode(image_base64)
+            image = decode_frame(image_buffer)
+        
+        if image is None:
+            return jsonify({'error': 'Failed to decode image'}), 400
         
         # Get face encoding using InsightFace
-        nparr = np.frombuffer(image_buffer, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
         rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
         
-        faces = face_analyzer.get(rgb_image)
+        with time_stage('analysis'):
+            faces = face_analyzer.get(rgb_image)
         
         if len(faces) == 0:
             return jsonify({'error': 'No face detected in image'}), 400
@@ -702,57 +3017,238 @@ def enroll_face():
             face_id = f"face-{user_id}-{int(datetime.now().timestamp())}"
         
         # Store embedding
-        known_face_embeddings[face_id] = embedding
+        with time_stage('publish'):
+            snapshot = publish_gallery({face_id: embedding})
         
-        print(f"[Enroll] ✓ Face enrolled: {face_id} (Total: {len(known_face_embeddings)})")
+        logger.info(f"[Enroll] ✓ Face enrolled: {face_id} (Total: {len(snapshot)})")
         
         # Optional: Update Next.js database
         if USE_NEXTJS_VERIFICATION:
             try:
-                requests.post(f'{NEXTJS_API_URL}/api/admin/update-face-id', json={
-                    'userId': user_id,
-                    'faceId': face_id
-                }, timeout=5)
+                with time_stage('nextjs_update'):
+                    requests.post(f'{NEXTJS_API_URL}/api/admin/update-face-id', json={
+                        'userId': user_id,
+                        'faceId': face_id
+                    }, headers=trace_headers(), timeout=5)
             except Exception as e:
-                print(f"[Warning] Next.js update failed: {e}")
+                logger.warning(f"[Warning] Next.js update failed: {e}")
         
         return jsonify({
             'success': True,
             'faceId': face_id,
+            'galleryVersion': snapshot.version,
             'message': 'Face enrolled successfully'
         })
         
     except Exception as e:
-        print(f"[Error] /enroll: {e}")
+        logger.error(f"[Error] /enroll: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+def viewer_detections(detections):
+    """
+    Reduce frame results to what the viewer draws (box, id, score, status, name)
+    
+    Keeps user details such as email and student ID out of the stream headers.
+    """
+    return [
+        {
+            'boundingBox': d.get('boundingBox'),
+            'faceId': d.get('faceId'),
+            'confidence': d.get('confidence', 0.0),
+            'verified': d.get('verified', False),
+            'eligible': d.get('eligible', False),
+            'user': {'name': (d.get('user') or {}).get('name', '')}
+        }
+        for d in detections
+    ]
+
+@app.route('/api/frames/stream', methods=['GET'])
+def stream_frames():
+    """
+    Live MJPEG stream (multipart/x-mixed-replace) for video viewers
+    
+    Every processed frame is pushed exactly once as its original JPEG bytes.
+    Each part also carries X-Frame-Seq and X-Detections (compact JSON of the
+    fields video_viewer.py draws) headers; browsers ignore them. When no new
+    frame arrives for STREAM_KEEPALIVE_SECONDS the last part is sent again
+    (same X-Frame-Seq), which keeps viewers under their read timeout and
+    lets a write to a dead client fail.
+    """
+    def generate():
+        # Empty first chunk sends the response headers before the first frame arrives
+        yield b''
+        
+        seq = latest_frame_seq - 1 if latest_frame_buffer is not None else latest_frame_seq
+        part = None
+        while True:
+            frame = wait_for_frame(seq, STREAM_KEEPALIVE_SECONDS)
+            if frame is None:
+                if part is not None:
+                    yield part
+                continue
+            seq, jpeg_bytes, detections = frame
+            detections_json = json.dumps(viewer_detections(detections), separators=(',', ':'))
+            part = (
+                b'--frame\r\n'
+                b'Content-Type: image/jpeg\r\n'
+                + f'Content-Length: {len(jpeg_bytes)}\r\n'.encode()
+                + f'X-Frame-Seq: {seq}\r\n'.encode()
+                + f'X-Detections: {detections_json}\r\n\r\n'.encode()
+                + jpeg_bytes
+                + b'\r\n'
+            )
+            yield part
+    
+    return Response(generate(), mimetype='multipart/x-mixed-replace; boundary=frame',
+                    headers={'Cache-Control': 'no-cache'})
+
+@app.route('/api/frames/events', methods=['GET'])
+def stream_detection_events():
+    """
+    Server-sent events with the detection results of every processed frame
+    (no image data; the same fields as X-Detections, see viewer_detections())
+    """
+    def generate():
+        yield ': connected\n\n'
+        
+        seq = latest_frame_seq
+        while True:
+            frame = wait_for_frame(seq, STREAM_KEEPALIVE_SECONDS)
+            if frame is None:
+                yield ': keepalive\n\n'
+                continue
+            seq, _, detections = frame
+            yield f"id: {seq}\nevent: detections\ndata: {json.dumps(viewer_detections(detections), separators=(',', ':'))}\n\n"
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
+
+def frame_etag(seq):
+    """ETag for a published frame sequence number"""
+    return f'"frame-{seq}"'
+
+def parse_frame_etag(value):
+    """
+    Pull the frame sequence number out of an If-None-Match header
+    
+    Returns:
+        Highest sequence number among the listed tags, or None
+    """
+    if not value:
+        return None
+    seqs = [int(seq) for seq in re.findall(r'"frame-(\d+)"', value)]
+    return max(seqs) if seqs else None
+
+def get_latest_frame_payload():
+    """
+    Encoded JSON body for the latest frame, built once per frame and shared by all pollers
+    
+    Returns:
+        (seq, body_bytes), or (seq, None) if no frame has been published yet
+    """
+    global latest_frame_payload
+    
+    with frame_lock:
+        seq = latest_frame_seq
+        if latest_frame_buffer is None:
+            return seq, None
+        if latest_frame_payload[0] == seq:
+            return latest_frame_payload
+        frame_buf = latest_frame_buffer
+        detections = latest_detection_results
+        timestamp = latest_frame_time
+    
+    # Encode outside the lock; a concurrent poller may do the same work once
+    body = json.dumps({
+        'frame': base64.b64encode(frame_buf).decode('ascii'),
+        'detections': detections,
+        'seq': seq,
+        'timestamp': timestamp.isoformat()
+    }, separators=(',', ':')).encode('utf-8')
+    
+    with frame_lock:
+        if latest_frame_payload[0] < seq:
+            latest_frame_payload = (seq, body)
+    return seq, body
+
 @app.route('/api/frames/latest', methods=['GET'])
 def get_latest_frame():
-    """Get latest frame with detection results for video viewer"""
+    """
+    Get latest frame with detection results for video viewer
+    
+    Polling clients can avoid re-downloading a frame they already have:
+        If-None-Match: "frame-<seq>"  or  ?after=<seq>
+            304 Not Modified while no newer frame exists
+        ?wait=<seconds> (with either of the above)
+            long-poll: hold the request until the next frame is published
+            (at most MAX_LONG_POLL_SECONDS), 304 if none arrives in time
+    
+    Every 200 response carries the frame's ETag and X-Frame-Seq headers.
+    """
     try:
-        with frame_lock:
-            frame_buf = latest_frame_buffer
-            detections = latest_detection_results.copy() if latest_detection_results else []
+        after = request.args.get('after', type=int)
+        if after is None:
+            after = parse_frame_etag(request.headers.get('If-None-Match'))
+        if after is not None and after > latest_frame_seq:
+            after = None  # Tag from before a service restart - send the current frame
+        wait = min(max(request.args.get('wait', 0, type=float), 0), MAX_LONG_POLL_SECONDS)
+        
+        if after is not None and wait > 0:
+            wait_for_frame(after, wait)
         
-        if frame_buf is None:
+        seq, body = get_latest_frame_payload()
+        
+        if body is None:
             return jsonify({
                 'frame': None,
                 'detections': [],
+                'seq': seq,
                 'message': 'No frames received yet'
             })
         
-        # Encode frame as base64
-        frame_base64 = base64.b64encode(frame_buf).decode('utf-8')
+        headers = {
+            'ETag': frame_etag(seq),
+            'X-Frame-Seq': str(seq),
+            'Cache-Control': 'no-cache'
+        }
+        if after is not None and seq <= after:
+            return Response(status=304, headers=headers)
         
-        return jsonify({
-            'frame': frame_base64,
-            'detections': detections,
-            'timestamp': datetime.now().isoformat()
-        })
+        return Response(body, mimetype='application/json', headers=headers)
+    except Exception as e:
+        logger.error(f"[Error] /api/frames/latest: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/frames/annotated', methods=['GET'])
+def get_annotated_frame_jpeg():
+    """
+    Latest frame with detection boxes drawn, as a JPEG
+    
+    The overlay is only rendered when this endpoint (or the window) asks for
+    it, so headless deployments never pay for drawing. Supports the same
+    If-None-Match ETag as /api/frames/latest.
+    """
+    try:
+        seq, annotated_image = get_annotated_frame()
+        if annotated_image is None:
+            return jsonify({'error': 'No frames received yet'}), 404
+        
+        headers = {
+            'ETag': frame_etag(seq),
+            'X-Frame-Seq': str(seq),
+            'Cache-Control': 'no-cache'
+        }
+        if parse_frame_etag(request.headers.get('If-None-Match')) == seq:
+            return Response(status=304, headers=headers)
+        
+        ok, jpeg = cv2.imencode('.jpg', annotated_image)
+        if not ok:
+            return jsonify({'error': 'Failed to encode frame'}), 500
+        return Response(jpeg.tobytes(), mimetype='image/jpeg', headers=headers)
     except Exception as e:
-        print(f"[Error] /api/frames/latest: {e}")
+        logger.error(f"[Error] /api/frames/annotated: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/load-face', methods=['POST'])
@@ -768,41 +3264,195 @@ def load_face():
         }
     """
     try:
-        data = request.json
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'JSON body required'}), 400
         face_id = data.get('faceId')
         embedding = data.get('embedding')
         
         if not face_id or not embedding:
             return jsonify({'error': 'faceId and embedding required'}), 400
         
+        # Same checks as /load-face/bulk (parse_embedding_matrix)
+        try:
+            embedding = np.array(embedding, dtype=np.float32)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'embedding must be a list of numbers'}), 400
+        if embedding.shape != (EMBEDDING_DIM,):
+            return jsonify({'error': f'Expected {EMBEDDING_DIM} embedding values, got shape {list(embedding.shape)}'}), 400
+        if not np.isfinite(embedding).all():
+            return jsonify({'error': 'Embeddings contain NaN or infinite values'}), 400
+        
         # Store embedding
-        known_face_embeddings[face_id] = np.array(embedding)
+        snapshot = publish_gallery({face_id: embedding})
         
-        print(f"[Load] ✓ Face loaded: {face_id} (Total: {len(known_face_embeddings)})")
+        logger.info(f"[Load] ✓ Face loaded: {face_id} (Total: {len(snapshot)})")
         
         return jsonify({
             'success': True,
+            'galleryVersion': snapshot.version,
             'message': 'Face loaded successfully'
         })
     except Exception as e:
-        print(f"[Error] /load-face: {e}")
+        logger.error(f"[Error] /load-face: {e}")
+        return jsonify({'error': str(e)}), 500
+
+def parse_embedding_matrix(raw_bytes, dim=EMBEDDING_DIM):
+    """
+    Interpret packed embeddings as an (N, dim) float32 matrix without copying
+
+    Args:
+        raw_bytes: Either raw little-endian float32 values (row-major)
+                   or the contents of a .npy file
+        dim: Embedding dimension used to shape raw input
+
+    Returns:
+        Read-only numpy array of shape (N, dim) backed by raw_bytes
+    """
+    if raw_bytes[:6] == b'\x93NUMPY':
+        # Parse the .npy header ourselves so the data can be viewed in place
+        # (np.load would copy the whole payload into a new array)
+        stream = io.BytesIO(raw_bytes)
+        version = np.lib.format.read_magic(stream)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+        
+        if fortran_order:
+            raise ValueError('Fortran-ordered .npy arrays are not supported')
+        if len(shape) != 2 or shape[1] != dim:
+            raise ValueError(f'Expected array of shape (N, {dim}), got {shape}')
+        
+        count = shape[0] * shape[1]
+        matrix = np.frombuffer(raw_bytes, dtype=dtype, count=count, offset=stream.tell())
+        matrix = matrix.reshape(shape)
+        
+        if matrix.dtype != np.dtype('<f4'):
+            # Only non-float32 input pays for a conversion copy
+            matrix = matrix.astype('<f4')
+    else:
+        if len(raw_bytes) % (4 * dim) != 0:
+            raise ValueError(f'Raw payload size {len(raw_bytes)} is not a multiple of {4 * dim} bytes')
+        matrix = np.frombuffer(raw_bytes, dtype='<f4').reshape(-1, dim)
+    
+    if not np.isfinite(matrix).all():
+        raise ValueError('Embeddings contain NaN or infinite values')
+    
+    return matrix
+
+@app.route('/load-face/bulk', methods=['POST'])
+def load_faces_bulk():
+    """
+    Load many face embeddings in one request (binary alternative to /load-face)
+    
+    Request:
+        - Content-Type: multipart/form-data
+        - embeddings: file with packed little-endian float32 rows
+                      (raw bytes or .npy), one row of 512 floats per face
+        - ids: JSON list of face IDs or newline-separated IDs, same order as rows
+        - mode: "merge" (default) adds/overwrites faces,
+                "replace" swaps the whole gallery for the uploaded one
+    """
+    try:
+        embeddings_file = request.files.get('embeddings')
+        ids_field = request.form.get('ids')
+        if ids_field is None and 'ids' in request.files:
+            ids_field = request.files['ids'].read().decode('utf-8')
+        mode = request.form.get('mode', request.args.get('mode', 'merge'))
+        
+        if embeddings_file is None or not ids_field:
+            return jsonify({'error': 'embeddings file and ids required'}), 400
+        
+        if mode not in ('merge', 'replace'):
+            return jsonify({'error': "mode must be 'merge' or 'replace'"}), 400
+        
+        ids_field = ids_field.strip()
+        if ids_field.startswith('['):
+            try:
+                face_ids = json.loads(ids_field)
+            except ValueError:
+                return jsonify({'error': 'ids is not valid JSON'}), 400
+        else:
+            face_ids = [line.strip() for line in ids_field.splitlines() if line.strip()]
+        
+        if any(not isinstance(face_id, str) or not face_id for face_id in face_ids):
+            return jsonify({'error': 'ids must be non-empty strings'}), 400
+        
+        if len(set(face_ids)) != len(face_ids):
+            return jsonify({'error': 'ids must be unique'}), 400
+        
+        try:
+            matrix = parse_embedding_matrix(embeddings_file.read())
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        if matrix.shape[0] != len(face_ids):
+            return jsonify({
+                'error': f'Got {matrix.shape[0]} embeddings for {len(face_ids)} ids'
+            }), 400
+        
+        # Rows are views into the uploaded buffer - no per-face copies
+        loaded = dict(zip(face_ids, matrix))
+        snapshot = publish_gallery(loaded, replace=(mode == 'replace'))
+        
+        logger.info(f"[Load] ✓ Bulk {mode}: {len(face_ids)} face(s) (Total: {len(snapshot)})")
+        
+        return jsonify({
+            'success': True,
+            'mode': mode,
+            'loaded': len(face_ids),
+            'known_faces': len(snapshot),
+            'galleryVersion': snapshot.version,
+            'message': 'Faces loaded successfully'
+        })
+    except Exception as e:
+        logger.error(f"[Error] /load-face/bulk: {e}")
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
-    # Initialize InsightFace
-    if not initialize_insightface():
-        exit(1)
+    import argparse
     
-    # Load enrolled faces from database first, fallback to image.jpg
-    if not load_enrolled_faces_from_database():
-        # Fallback to image.jpg if database loading fails
-        load_face_from_image_jpg()
+    parser = argparse.ArgumentParser(description='InsightFace face recognition service')
+    parser.add_argument('--replay', metavar='DUMP_DIR',
+                        help='Replay a recording dump through the pipeline and exit')
+    parser.add_argument('--replay-output', metavar='FILE',
+                        help='Where to write replay results (default: DUMP_DIR/replay.jsonl)')
+    args = parser.parse_args()
+    
+    # Per-camera settings (optional)
+    load_camera_config()
+    
+    if args.replay:
+        if not initialize_insightface():
+            exit(1)
+        # A dump with gallery.npy brings its own gallery; otherwise read the
+        # current one without writing anything back to Next.js
+        if not os.path.exists(os.path.join(args.replay, 'gallery.npy')):
+            load_startup_gallery(update_face_ids=False)
+        summary = replay_recording(args.replay, args.replay_output)
+        logger.info(
+            f"[Replay] {summary['frames']} frame(s) of {summary['camera_id']}, "
+            f"{summary['mismatches']} recognition mismatch(es), "
+            f"{summary['decision_differences']} consensus decision difference(s) -> {summary['output']}"
+        )
+        sys.exit(1 if summary['mismatches'] else 0)
+    
+    # Models and gallery load in the background so the port is bound right away;
+    # /health reports progress and /ready flips once everything is warm
+    startup_loader = BackgroundLoader([
+        ('models', initialize_insightface),
+        ('gallery', load_startup_gallery)
+    ]).start()
     
     # Start window display thread if enabled
     if SHOW_WINDOW:
         window_thread = threading.Thread(target=window_display_thread, daemon=True)
         window_thread.start()
     
+    # Persistent frame ingest for cameras that keep a connection open
+    start_stream_ingest()
+    
     # Run Flask app
     port = int(os.getenv('PORT', 5000))
     
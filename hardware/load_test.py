@@ -0,0 +1,311 @@
+"""
+Load generator for the InsightFace face recognition service
+
+Replays a directory of JPEG frames (or a recording dump from
+/api/cameras/<id>/recording/dump) as if it came from many ESP32 cameras,
+and reports how well the service keeps up.
+
+Each simulated camera behaves like the ESP32: it sends one frame, waits for
+the result, then sends the next one at its frame interval. Frames that come
+due while the previous request is still in flight are skipped, and they count
+as drops.
+
+Run:
+    python load_test.py recordings/counter-1-20240115-121530
+    python load_test.py "frames/*.jpg" --cameras 8 --fps 5 --duration 60
+    python load_test.py frames/ --transport stream --cameras 16 --json result.json
+"""
+
+import argparse
+import glob
+import json
+import math
+import os
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+
+def load_frames(source):
+    """
+    Read the frames to replay into memory
+
+    Args:
+        source: Recording dump directory (frames in manifest order),
+                directory of .jpg/.jpeg files (sorted by name) or a glob pattern
+    """
+    if os.path.isdir(source):
+        manifest_path = os.path.join(source, 'manifest.json')
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                paths = [os.path.join(source, frame['file']) for frame in json.load(f)['frames']]
+        else:
+            paths = sorted(
+                os.path.join(source, name) for name in os.listdir(source)
+                if name.lower().endswith(('.jpg', '.jpeg'))
+            )
+    else:
+        paths = sorted(glob.glob(source))
+
+    frames = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            frames.append(f.read())
+    return frames
+
+class HttpCamera:
+    """Sends frames as POST /api/hardware/video-stream, like the ESP32 HTTP path"""
+
+    def __init__(self, service_url, camera_id, timeout):
+        self.url = f"{service_url}/api/hardware/video-stream"
+        self.session = requests.Session()
+        self.session.headers.update({'Content-Type': 'image/jpeg', 'X-Camera-Id': camera_id})
+        self.timeout = timeout
+
+    def send(self, frame):
+        """Send one frame; returns the HTTP status code"""
+        return self.session.post(self.url, data=frame, timeout=self.timeout).status_code
+
+    def close(self):
+        self.session.close()
+
+class StreamCamera:
+    """Sends frames over the persistent TCP stream ingest (see FrameStreamHandler)"""
+
+    def __init__(self, host, port, camera_id, timeout):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.sendall(f"HELLO {camera_id} json\n".encode())
+
+    def recv_exact(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError('Stream closed by service')
+            data.extend(chunk)
+        return bytes(data)
+
+    def send(self, frame):
+        """Send one frame; returns the status code from the compact JSON result"""
+        self.sock.sendall(struct.pack('!I', len(frame)) + frame)
+        (length,) = struct.unpack('!I', self.recv_exact(4))
+        return json.loads(self.recv_exact(length)).get('s', 0)
+
+    def close(self):
+        try:
+            self.sock.sendall(struct.pack('!I', 0))
+        except OSError:
+            pass
+        self.sock.close()
+
+class CameraStats:
+    """Outcome counters and latencies of one simulated camera"""
+
+    def __init__(self):
+        self.latencies = []
+        self.ok = 0
+        self.errors = 0     # Non-200 responses
+        self.failures = 0   # Timeouts and connection errors
+        self.skipped = 0    # Frames not sent because the previous one was still in flight
+
+def run_camera(make_camera, frames, start_index, fps, jitter, start_time, end_time, stats):
+    """Replay frames for one camera at fps until end_time"""
+    interval = 1.0 / fps
+    camera = None
+    index = start_index
+    next_due = start_time + random.uniform(0, interval)  # Don't fire all cameras at once
+
+    while True:
+        now = time.perf_counter()
+        if next_due >= end_time:
+            break
+        if next_due > now:
+            time.sleep(next_due - now)
+
+        try:
+            if camera is None:
+                camera = make_camera()
+            sent_at = time.perf_counter()
+            status = camera.send(frames[index % len(frames)])
+            stats.latencies.append(time.perf_counter() - sent_at)
+            if status == 200:
+                stats.ok += 1
+            else:
+                stats.errors += 1
+        except Exception:
+            stats.failures += 1
+            if camera is not None:
+                camera.close()
+                camera = None
+        index += 1
+
+        next_due += interval * (1 + random.uniform(-jitter, jitter))
+        now = time.perf_counter()
+        while next_due < now and next_due < end_time:
+            stats.skipped += 1
+            next_due += interval
+
+    if camera is not None:
+        camera.close()
+
+def scrape_metrics(service_url):
+    """Service CPU seconds and dropped-frame total from /metrics (None if unavailable)"""
+    try:
+        response = requests.get(f"{service_url}/metrics", timeout=2)
+        response.raise_for_status()
+    except requests.RequestException:
+        return None
+
+    cpu_seconds = None
+    dropped = 0
+    for line in response.text.splitlines():
+        if line.startswith('process_cpu_seconds_total '):
+            cpu_seconds = float(line.split()[1])
+        elif line.startswith('face_service_frames_dropped_total'):
+            dropped += int(float(line.split()[-1]))
+    return {'cpu_seconds': cpu_seconds, 'dropped': dropped}
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = min(len(sorted_values), max(1, math.ceil(p / 100.0 * len(sorted_values)))) - 1
+    return sorted_values[rank]
+
+def run_load_test(args):
+    frames = load_frames(args.frames)
+    if not frames:
+        print(f"No JPEG frames found in {args.frames}")
+        return None
+
+    if args.transport == 'stream':
+        host = args.stream_host or urlparse(args.url).hostname
+        def camera_factory(camera_id):
+            return lambda: StreamCamera(host, args.stream_port, camera_id, args.timeout)
+    else:
+        def camera_factory(camera_id):
+            return lambda: HttpCamera(args.url, camera_id, args.timeout)
+
+    print(f"Replaying {len(frames)} frame(s) from {args.frames}")
+    print(f"{args.cameras} camera(s) x {args.fps} FPS (jitter ±{args.jitter:.0%}) "
+          f"over {args.transport} for {args.duration}s against {args.url}")
+
+    metrics_before = scrape_metrics(args.url)
+    client_cpu_before = time.process_time()
+
+    start_time = time.perf_counter()
+    end_time = start_time + args.duration
+    camera_stats = [CameraStats() for _ in range(args.cameras)]
+    threads = []
+    for i, stats in enumerate(camera_stats):
+        camera_id = f"{args.camera_prefix}-{i + 1}"
+        thread = threading.Thread(
+            target=run_camera,
+            args=(camera_factory(camera_id), frames, i * len(frames) // args.cameras,
+                  args.fps, args.jitter, start_time, end_time, stats),
+            daemon=True
+        )
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.perf_counter() - start_time
+    client_cpu = time.process_time() - client_cpu_before
+    metrics_after = scrape_metrics(args.url)
+
+    latencies = sorted(l for stats in camera_stats for l in stats.latencies)
+    ok = sum(stats.ok for stats in camera_stats)
+    errors = sum(stats.errors for stats in camera_stats)
+    failures = sum(stats.failures for stats in camera_stats)
+    skipped = sum(stats.skipped for stats in camera_stats)
+    sent = ok + errors + failures
+    due = sent + skipped
+
+    report = {
+        'transport': args.transport,
+        'cameras': args.cameras,
+        'target_fps': args.fps,
+        'duration_seconds': round(elapsed, 2),
+        'frames_due': due,
+        'frames_sent': sent,
+        'frames_ok': ok,
+        'errors': errors,
+        'failures': failures,
+        'skipped': skipped,
+        'drop_rate': round((due - ok) / due, 4) if due else None,
+        'throughput_fps': round(ok / elapsed, 2),
+        'latency_ms': {
+            name: round(percentile(latencies, p) * 1000, 1) if latencies else None
+            for name, p in (('p50', 50), ('p95', 95), ('p99', 99), ('max', 100))
+        },
+        'client_cpu_percent': round(client_cpu / elapsed * 100, 1),
+        'service_cpu_percent': None,
+        'service_dropped': None
+    }
+    if metrics_before and metrics_after:
+        if metrics_before['cpu_seconds'] is not None and metrics_after['cpu_seconds'] is not None:
+            report['service_cpu_percent'] = round(
+                (metrics_after['cpu_seconds'] - metrics_before['cpu_seconds']) / elapsed * 100, 1
+            )
+        report['service_dropped'] = metrics_after['dropped'] - metrics_before['dropped']
+
+    return report
+
+def print_report(report):
+    latency = report['latency_ms']
+    print()
+    print("=" * 60)
+    print(f"Throughput:   {report['throughput_fps']} frames/s "
+          f"({report['frames_ok']} ok of {report['frames_due']} due)")
+    print(f"Latency:      p50 {latency['p50']} ms | p95 {latency['p95']} ms | "
+          f"p99 {latency['p99']} ms | max {latency['max']} ms")
+    if report['drop_rate'] is not None:
+        print(f"Drop rate:    {report['drop_rate']:.1%} "
+              f"(skipped {report['skipped']}, errors {report['errors']}, failures {report['failures']})")
+    if report['service_cpu_percent'] is not None:
+        print(f"Service CPU:  {report['service_cpu_percent']}% (100% = one core)")
+    if report['service_dropped'] is not None:
+        print(f"Service drop: {report['service_dropped']} frame(s) rejected by the service")
+    print(f"Client CPU:   {report['client_cpu_percent']}%")
+    print("=" * 60)
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay JPEG frames against the face recognition service')
+    parser.add_argument('frames', help='Recording dump, directory of JPEGs or glob pattern')
+    parser.add_argument('--url', default='http://localhost:5000', help='Service URL (default: %(default)s)')
+    parser.add_argument('--transport', choices=('http', 'stream'), default='http',
+                        help='POST /api/hardware/video-stream or the persistent TCP stream ingest')
+    parser.add_argument('--stream-host', help='Stream ingest host (default: host of --url)')
+    parser.add_argument('--stream-port', type=int, default=5001, help='Stream ingest port (default: %(default)s)')
+    parser.add_argument('--cameras', type=int, default=1, help='Simulated cameras (default: %(default)s)')
+    parser.add_argument('--fps', type=float, default=2.0, help='Frames per second per camera (default: %(default)s)')
+    parser.add_argument('--jitter', type=float, default=0.1,
+                        help='Random variation of the frame interval, as a fraction (default: %(default)s)')
+    parser.add_argument('--duration', type=float, default=30.0, help='Seconds to run (default: %(default)s)')
+    parser.add_argument('--timeout', type=float, default=10.0, help='Per-frame timeout in seconds (default: %(default)s)')
+    parser.add_argument('--camera-prefix', default='load', help='Camera IDs are <prefix>-1, <prefix>-2, ...')
+    parser.add_argument('--json', metavar='FILE', help='Also write the report as JSON')
+    args = parser.parse_args()
+
+    if args.cameras < 1 or args.fps <= 0 or not 0 <= args.jitter < 1:
+        parser.error('--cameras must be >= 1, --fps > 0 and 0 <= --jitter < 1')
+
+    report = run_load_test(args)
+    if report is None:
+        sys.exit(1)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+"""
+Stand-in for the Next.js hardware API, for offline benchmarks and tests
+
+Implements the endpoints the face recognition service calls, backed by an
+in-memory roster instead of MongoDB:
+    GET  /api/hardware/enrolled-faces
+    POST /api/hardware/verify
+    PUT  /api/hardware/update-face-id
+    POST /api/admin/update-face-id     (called by /enroll)
+
+Responses match the real routes in app/api/hardware/. Latency, error rate
+and eligibility are configurable, and synthetic rosters of thousands of
+students can be generated to benchmark gallery loading and verification.
+
+Run:
+    python nextjs_emulator.py fixtures/roster.json
+    python nextjs_emulator.py --synthetic 5000 --photos faces/ --latency 40 --error-rate 0.01
+
+Then point the service at it:
+    NEXTJS_API_URL=http://localhost:3001 python face_recognition_insightface.py
+"""
+
+import argparse
+import base64
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+
+from flask import Flask, jsonify, request
+
+app = Flask(__name__)
+
+# Emulator settings (overridden from the command line)
+settings = {
+    'latency_ms': 0.0,         # Added to every request
+    'latency_jitter_ms': 0.0,  # Uniform ± variation of the added latency
+    'error_rate': 0.0,         # Fraction of requests answered with 500
+    'one_meal_per_day': False  # Treat every eligible verification as a completed meal
+}
+
+roster = {}         # student id -> student dict
+face_index = {}     # faceId -> student id
+meals_today = set() # student ids that already had a meal (with one_meal_per_day)
+request_counts = Counter()
+meal_record_ids = itertools.count(1)
+state_lock = threading.Lock()
+rng = random.Random()
+
+def photo_data_url(path):
+    """Photo file as the data URL stored in the student collection"""
+    with open(path, 'rb') as f:
+        return 'data:image/jpeg;base64,' + base64.b64encode(f.read()).decode('ascii')
+
+def load_roster(path):
+    """
+    Load a fixture roster
+
+    File format (JSON list; photoPath is relative to the fixture file):
+        [
+            {"id": "s1", "name": "Piyal", "studentId": "2021-001", "email": "piyal@example.com",
+             "faceId": "face-piyal-001", "photoPath": "../image1.jpg",
+             "eligible": true, "tokenNumber": "T-0001", "mealPlan": "Monthly"}
+        ]
+    """
+    with open(path) as f:
+        students = json.load(f)
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    for student in students:
+        photo_path = student.pop('photoPath', None)
+        if photo_path:
+            student['photo'] = photo_data_url(os.path.join(base_dir, photo_path))
+    return students
+
+def synthetic_roster(count, photo_paths, eligible_ratio, with_face_ids):
+    """
+    Generate a roster of count students
+
+    Photos are cycled from photo_paths (loaded once and shared), so the
+    service does one full detection + embedding per student when it loads
+    the gallery.
+    """
+    photos = [photo_data_url(path) for path in photo_paths]
+    students = []
+    for i in range(count):
+        student_id = f"synthetic-{i + 1:06d}"
+        eligible = rng.random() < eligible_ratio
+        students.append({
+            'id': student_id,
+            'name': f"Student {i + 1}",
+            'studentId': f"S{i + 1:06d}",
+            'email': f"student{i + 1}@example.com",
+            'faceId': f"face-{student_id}" if with_face_ids else None,
+            'photo': photos[i % len(photos)] if photos else None,
+            'eligible': eligible,
+            'tokenNumber': f"T-{i + 1:06d}" if eligible else None,
+            'mealPlan': 'Monthly' if eligible else None
+        })
+    return students
+
+def set_roster(students):
+    """Replace the roster and its faceId index"""
+    global roster, face_index
+    with state_lock:
+        roster = {student['id']: student for student in students}
+        face_index = {student['faceId']: student['id'] for student in students if student.get('faceId')}
+        meals_today.clear()
+
+def public_user(student):
+    """User fields the real verify route returns"""
+    return {
+        'id': student['id'],
+        'name': student.get('name'),
+        'studentId': student.get('studentId'),
+        'email': student.get('email')
+    }
+
+@app.before_request
+def simulate_conditions():
+    """Apply configured latency and random failures to every API request"""
+    if not request.path.startswith('/api/'):
+        return None
+
+    with state_lock:
+        request_counts[request.path] += 1
+
+    delay_ms = settings['latency_ms'] + rng.uniform(-1, 1) * settings['latency_jitter_ms']
+    if delay_ms > 0:
+        time.sleep(delay_ms / 1000.0)
+
+    if settings['error_rate'] and rng.random() < settings['error_rate']:
+        with state_lock:
+            request_counts['errors_injected'] += 1
+        return jsonify({'error': 'Internal server error'}), 500
+    return None
+
+@app.route('/api/hardware/enrolled-faces', methods=['GET'])
+def enrolled_faces():
+    """All students with a photo (faceId may be missing)"""
+    with state_lock:
+        students = [
+            {key: student.get(key) for key in ('id', 'name', 'studentId', 'email', 'faceId', 'photo')}
+            for student in roster.values() if student.get('photo')
+        ]
+    return jsonify(students)
+
+@app.route('/api/hardware/verify', methods=['POST'])
+def verify():
+    """Look up a student by faceId / idCardNumber / pin and check meal eligibility"""
+    body = request.get_json(silent=True) or {}
+    method = body.get('method')
+    if method not in ('FACE', 'ID_CARD', 'PIN'):
+        return jsonify({'error': 'Invalid input', 'details': [{'path': ['method']}]}), 400
+
+    with state_lock:
+        student = None
+        if method == 'FACE' and body.get('faceId'):
+            student = roster.get(face_index.get(body['faceId']))
+        elif method == 'ID_CARD' and body.get('idCardNumber'):
+            student = next((s for s in roster.values() if s.get('idCardNumber') == body['idCardNumber']), None)
+        elif method == 'PIN' and body.get('pin'):
+            student = next((s for s in roster.values() if s.get('pin') == body['pin']), None)
+
+        if student is None:
+            return jsonify({'error': 'User not found', 'verified': False}), 404
+
+        if student['id'] in meals_today:
+            return jsonify({
+                'verified': True,
+                'user': public_user(student),
+                'eligible': False,
+                'reason': 'Already received meal today'
+            })
+
+        eligible = bool(student.get('eligible', True))
+        meal_record_id = None
+        if eligible:
+            meal_record_id = f"meal-{next(meal_record_ids)}"
+            if settings['one_meal_per_day']:
+                meals_today.add(student['id'])
+
+    response = {
+        'verified': True,
+        'user': public_user(student),
+        'eligible': eligible
+    }
+    # Same as the real route: keys are omitted when undefined
+    if meal_record_id:
+        response['mealRecordId'] = meal_record_id
+    if eligible and student.get('tokenNumber'):
+        response['tokenNumber'] = student['tokenNumber']
+    if eligible and student.get('mealPlan'):
+        response['mealPlan'] = student['mealPlan']
+    return jsonify(response)
+
+def update_face_id(student_id, face_id):
+    """Set a student's faceId (500 for unknown students, like the Prisma update)"""
+    if not isinstance(student_id, str) or not isinstance(face_id, str):
+        return jsonify({'error': 'Invalid input'}), 400
+
+    with state_lock:
+        student = roster.get(student_id)
+        if student is None:
+            return jsonify({'error': 'Internal server error'}), 500
+        if student.get('faceId'):
+            face_index.pop(student['faceId'], None)
+        student['faceId'] = face_id
+        face_index[face_id] = student_id
+
+    return jsonify({
+        'success': True,
+        'student': {'id': student_id, 'name': student.get('name'), 'faceId': face_id}
+    })
+
+@app.route('/api/hardware/update-face-id', methods=['PUT'])
+def hardware_update_face_id():
+    body = request.get_json(silent=True) or {}
+    return update_face_id(body.get('studentId'), body.get('faceId'))
+
+@app.route('/api/admin/update-face-id', methods=['POST'])
+def admin_update_face_id():
+    body = request.get_json(silent=True) or {}
+    return update_face_id(body.get('userId'), body.get('faceId'))
+
+@app.route('/emulator/stats', methods=['GET'])
+def emulator_stats():
+    """Request counts per endpoint and roster size"""
+    with state_lock:
+        return jsonify({
+            'students': len(roster),
+            'with_face_id': len(face_index),
+            'meals_today': len(meals_today),
+            'requests': dict(request_counts),
+            'settings': settings
+        })
+
+@app.route('/emulator/reset', methods=['POST'])
+def emulator_reset():
+    """Forget meals and request counts (roster is kept)"""
+    with state_lock:
+        meals_today.clear()
+        request_counts.clear()
+    return jsonify({'success': True})
+
+def main():
+    parser = argparse.ArgumentParser(description='Emulate the Next.js hardware API for the face recognition service')
+    parser.add_argument('roster', nargs='?', help='Fixture roster JSON (see load_roster)')
+    parser.add_argument('--synthetic', type=int, metavar='N', help='Generate N synthetic students instead')
+    parser.add_argument('--photos', metavar='DIR',
+                        help='Face photos cycled across synthetic students (default: hardware/image1.jpg)')
+    parser.add_argument('--without-face-ids', action='store_true',
+                        help='Synthetic students start without faceId (service assigns them via update-face-id)')
+    parser.add_argument('--eligible-ratio', type=float, default=0.9,
+                        help='Fraction of synthetic students eligible for a meal (default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=0.0, metavar='MS', help='Added latency per request')
+    parser.add_argument('--latency-jitter', type=float, default=0.0, metavar='MS', help='Uniform ± latency variation')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests failing with 500')
+    parser.add_argument('--one-meal-per-day', action='store_true',
+                        help='Second eligible verification of a student returns "Already received meal today"')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for rosters, latency and errors')
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', 3001)))
+    args = parser.parse_args()
+
+    rng.seed(args.seed)
+    settings.update({
+        'latency_ms': args.latency,
+        'latency_jitter_ms': args.latency_jitter,
+        'error_rate': args.error_rate,
+        'one_meal_per_day': args.one_meal_per_day
+    })
+
+    if args.synthetic:
+        if args.photos:
+            photo_paths = sorted(
+                os.path.join(args.photos, name) for name in os.listdir(args.photos)
+                if name.lower().endswith(('.jpg', '.jpeg'))
+            )
+        else:
+            default_photo = os.path.join(os.path.dirname(__file__), 'image1.jpg')
+            photo_paths = [default_photo] if os.path.exists(default_photo) else []
+        students = synthetic_roster(args.synthetic, photo_paths, args.eligible_ratio, not args.without_face_ids)
+    elif args.roster:
+        students = load_roster(args.roster)
+    else:
+        parser.error('give a roster file or --synthetic N')
+
+    set_roster(students)
+    print(f"Next.js emulator: {len(students)} student(s), "
+          f"latency {args.latency}±{args.latency_jitter} ms, error rate {args.error_rate:.1%}")
+    print(f"Set NEXTJS_API_URL=http://localhost:{args.port} for the face recognition service")
+
+    app.run(host='0.0.0.0', port=args.port, debug=False, use_reloader=False, threaded=True)
+
+if __name__ == "__main__":
+    main()
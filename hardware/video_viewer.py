@@ -22,6 +22,7 @@ class VideoViewer:
         self.current_frame = None
         self.latest_results = None
         self.frame_lock = threading.Lock()
+        self.last_etag = None  # ETag of the last polled frame (skips unchanged frames)
         
         # Create window
         cv2.namedWindow(self.window_name, cv2.WINDOW_NORMAL)
@@ -30,13 +31,55 @@ class VideoViewer:
         print("Video Viewer initialized")
         print("Press 'q' to quit")
         
+    def iter_stream_frames(self):
+        """
+        Yield (frame, detections) from the service's MJPEG stream
+        
+        Each multipart part holds the original JPEG of one processed frame
+        plus an X-Detections header with that frame's results, so every
+        frame is transferred exactly once and without base64.
+        """
+        response = requests.get(f"{self.service_url}/api/frames/stream", stream=True, timeout=(3, 30))
+        response.raise_for_status()
+        
+        buffer = bytearray()
+        for chunk in response.iter_content(chunk_size=None):
+            buffer += chunk
+            
+            while True:
+                header_end = buffer.find(b'\r\n\r\n')
+                if header_end < 0:
+                    break
+                
+                # Part headers (boundary line and blank lines have no ':')
+                headers = {}
+                for line in bytes(buffer[:header_end]).decode('utf-8', 'replace').split('\r\n'):
+                    if ':' in line:
+                        name, value = line.split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+                
+                length = int(headers.get('content-length', 0))
+                body_start = header_end + 4
+                if len(buffer) < body_start + length:
+                    break  # Wait for the rest of the JPEG
+                
+                jpeg_bytes = bytes(buffer[body_start:body_start + length])
+                del buffer[:body_start + length]
+                
+                nparr = np.frombuffer(jpeg_bytes, np.uint8)
+                frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+                if frame is not None:
+                    yield frame, json.loads(headers.get('x-detections', '[]'))
+    
     def fetch_frame(self):
-        """Fetch latest frame from service"""
+        """Fetch latest frame from service (polling fallback for services without /api/frames/stream)"""
         try:
             # Get frames from Python service
             # Note: You may need to modify the service to store and serve frames
-            response = requests.get(f"{self.service_url}/api/frames/latest", timeout=1)
+            headers = {'If-None-Match': self.last_etag} if self.last_etag else {}
+            response = requests.get(f"{self.service_url}/api/frames/latest", headers=headers, timeout=1)
             if response.status_code == 200:
+                self.last_etag = response.headers.get('ETag')
                 data = response.json()
                 if data.get('frame'):
                     # Decode base64 frame
@@ -184,7 +227,23 @@ class VideoViewer:
         return frame
     
     def update_frame(self):
-        """Update frame in separate thread"""
+        """Update frame in separate thread (live stream, polling as fallback)"""
+        while self.running:
+            try:
+                for frame, detections in self.iter_stream_frames():
+                    with self.frame_lock:
+                        self.current_frame = frame
+                        self.latest_results = detections
+                    if not self.running:
+                        return
+            except requests.exceptions.HTTPError:
+                # Older service without the stream endpoint
+                print("Live stream not available, polling /api/frames/latest")
+                break
+            except Exception:
+                pass
+            time.sleep(1)  # Service restarting or unreachable - reconnect
+        
         while self.running:
             frame, detections = self.fetch_frame()
             if frame is not None:
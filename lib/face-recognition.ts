@@ -17,7 +17,8 @@ import { prisma } from './prisma'
 
 interface FaceDetectionResult {
   faces: Array<{
-    faceId: string
+    // null for faces that aren't enrolled or that failed the quality filter
+    faceId: string | null
     confidence: number
     boundingBox?: {
       x: number
@@ -25,6 +26,8 @@ interface FaceDetectionResult {
       width: number
       height: number
     }
+    // Failed quality check (e.g. "blurry"), null if the face was matched
+    skipReason?: string | null
   }>
 }
 
@@ -42,7 +45,7 @@ export async function recognizeFace(
     const faceServiceUrl =
       process.env.FACE_RECOGNITION_SERVICE_URL || 'http://localhost:5000'
     
-    const response = await fetch(`${faceServiceUrl}/detect`, {
+    const response = await fetch(`${faceServiceUrl}/detect?mode=recognize`, {
       method: 'POST',
       body: imageBuffer,
       headers: {